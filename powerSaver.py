@@ -14,24 +14,30 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import argparse
+import atexit
 import concurrent.futures
 import curses
 import math
 import select
+import signal
 import sys
 from datetime import datetime, timedelta
+from enum import Enum
 from pathlib import Path
-from typing import Tuple, List, Dict, Union, Optional
+from typing import Any, Tuple, List, Dict, Set, Union, Optional
 
 import powerSaver
 import version as ver
 from powerSaver.config_parser import ConfigParser
+from powerSaver.entryStatus import process_entry_status, service_entry_status, module_entry_status
 
 application_name = "powerSaver"
 version = ver.PROGRAM_VERSION
 default_config_file = 'config.yaml'
 
-config = ConfigParser(Path(default_config_file))
+# Loaded in __main__, importing this file must stay cheap
+config: ConfigParser
 
 
 def process_color(status: powerSaver.ProcessStatus) -> Tuple[int, int]:
@@ -43,6 +49,8 @@ def process_color(status: powerSaver.ProcessStatus) -> Tuple[int, int]:
     return 2, curses.A_DIM     # Gray
   if status == powerSaver.ProcessStatus.MANY:
     return 4, curses.A_NORMAL  # Yellow
+  if status == powerSaver.ProcessStatus.THROTTLED:
+    return 6, curses.A_NORMAL  # Cyan
   return 17, curses.A_NORMAL   # Black on Red
 
 
@@ -76,18 +84,38 @@ def module_color(status: powerSaver.ModuleStatus) -> Tuple[int, int]:
   return 17, curses.A_NORMAL   # Black on Red
 
 
-def service_status_to_module_status(status: powerSaver.ServiceStatus) -> powerSaver.ModuleStatus:
-  if status == powerSaver.ServiceStatus.RUNNING:
-    return powerSaver.ModuleStatus.USED
-  if status == powerSaver.ServiceStatus.STOPPED:
-    return powerSaver.ModuleStatus.NEEDS_CHECK
-  if status == powerSaver.ServiceStatus.TOGGLED:
-    return powerSaver.ModuleStatus.PARTIAL
-  if status == powerSaver.ServiceStatus.NOT_FOUND:
-    return powerSaver.ModuleStatus.NEEDS_CHECK
-  if status == powerSaver.ServiceStatus.CRASHED:
-    return powerSaver.ModuleStatus.NEEDS_CHECK
-  return powerSaver.ModuleStatus.ERROR
+def cpufreq_color(status: powerSaver.CpuFreqStatus) -> Tuple[int, int]:
+  if status == powerSaver.CpuFreqStatus.ACTIVE:
+    return 3, curses.A_NORMAL  # Green
+  if status == powerSaver.CpuFreqStatus.INACTIVE:
+    return 5, curses.A_NORMAL  # Red
+  if status == powerSaver.CpuFreqStatus.PARTIAL:
+    return 4, curses.A_NORMAL  # Yellow
+  if status == powerSaver.CpuFreqStatus.UNSUPPORTED:
+    return 2, curses.A_DIM     # Gray
+  return 17, curses.A_NORMAL   # Black on Red
+
+
+def device_color(status: powerSaver.DeviceStatus) -> Tuple[int, int]:
+  if status == powerSaver.DeviceStatus.AUTO:
+    return 3, curses.A_NORMAL  # Green
+  if status == powerSaver.DeviceStatus.ON:
+    return 5, curses.A_NORMAL  # Red
+  if status == powerSaver.DeviceStatus.PARTIAL:
+    return 4, curses.A_NORMAL  # Yellow
+  if status == powerSaver.DeviceStatus.NOT_FOUND:
+    return 2, curses.A_DIM     # Gray
+  return 17, curses.A_NORMAL   # Black on Red
+
+
+def profile_color(status: powerSaver.ProfileStatus) -> Tuple[int, int]:
+  if status == powerSaver.ProfileStatus.ACTIVE:
+    return 3, curses.A_NORMAL  # Green
+  if status == powerSaver.ProfileStatus.INACTIVE:
+    return 1, curses.A_NORMAL  # White
+  if status == powerSaver.ProfileStatus.APPLYING:
+    return 4, curses.A_NORMAL  # Yellow
+  return 17, curses.A_NORMAL   # Black on Red
 
 
 def menu_entry(std_screen: curses.window, y: int, text: str, text_format: Tuple[int, int], offset: int = 0):
@@ -143,126 +171,503 @@ def power_use_color(battery_watts: float) -> int:
 
 
 def calculate_menu_thread(processes: List[Dict[str, Union[str, List[str], powerSaver.ProcessStatus]]],
-                          services:  List[Dict[str, Union[str, List[str], powerSaver.ServiceStatus]]],
-                          modules:   List[Dict[str, Union[str, List[str], powerSaver.ModuleStatus]]],
                           process_manager: powerSaver.ProcessManager,
-                          service_manager: powerSaver.ServiceManager,
-                          module_manager:  powerSaver.ModuleManager,
-                          refresh: int,
-                          title: str,
-                          last_update_display: datetime,
-                          ) -> Tuple[List[Dict[str, Union[str, List[str], powerSaver.ProcessStatus]]],
-                                     List[Dict[str, Union[str, List[str], powerSaver.ProcessStatus]]],
-                                     List[Dict[str, Union[str, List[str], powerSaver.ServiceStatus]]],
-                                     List[Dict[str, Union[str, List[str], powerSaver.ModuleStatus]]],
-                                     int]:
-  now = datetime.now()
-  max_len = len(title)
+                          min_len: int,
+                          ) -> Tuple[List[Dict[str, Union[str, List[str], powerSaver.ProcessStatus]]], int]:
+  # Services and modules are not part of this, their status queries go through
+  # the privileged helper, which only exists in the main process
+  max_len = min_len
   for y, p in enumerate(processes):
     max_len = max(len(p["title"]), max_len)
-    p_status = set()
-    for proc in p["name"]:
-      if "cmdline" in p:
-        proc_status = process_manager.get_process_status(proc, p["cmdline"])
-      else:
-        proc_status = process_manager.get_process_status(proc)
-      for p_s in proc_status:
-        p_status.add(p_s)
-    if powerSaver.ProcessStatus.ERROR in p_status:
-      p["status"] = powerSaver.ProcessStatus.ERROR
-    elif len(p_status) == 0:
-      p["status"] = powerSaver.ProcessStatus.NO_PROC
-    elif len(p_status) > 1:
-      p["status"] = powerSaver.ProcessStatus.MANY
-    else:
-      p["status"] = p_status.pop()
+    p["status"] = process_entry_status(p, process_manager)
+    p["wakeups"] = process_manager.get_group_wakeup_rate(p["name"], p.get("cmdline"))
+  return processes, max_len
 
-  active_processes = []
+
+def load_processes(processes: List[Dict[str, Union[str, List[str], powerSaver.ProcessStatus]]],
+                   sudo: bool,
+                   helper: Optional[powerSaver.PrivilegedHelper]) -> powerSaver.ProcessManager:
+  process_manager = powerSaver.ProcessManager(sudo, watched_process_names(processes), helper=helper,
+                                              cmdline_names=powerSaver.cmdline_filtered_names(processes))
   for p in processes:
-    if p["status"] != powerSaver.ProcessStatus.NO_PROC:
-      active_processes.append(p)
-
-  for y, s in enumerate(services):
-    max_len = max(len(s["title"]), max_len)
-    if "status" not in s or last_update_display > now - timedelta(seconds=refresh):
-      s["status"] = service_manager.get_status(s["name"])
-      if "needs-modules" in s:
-        for mod in s["needs-modules"]:
-          if module_manager.get_module_status(mod) not in [powerSaver.ModuleStatus.LOADED,
-                                                           powerSaver.ModuleStatus.USED]:
-            s["status"] = powerSaver.ServiceStatus.NO_MODULES
-
-  for y, m in enumerate(modules):
-    max_len = max(len(m["title"]), max_len)
-    if "status" not in m or last_update_display > now - timedelta(seconds=refresh):
-      status = []
-      if "usage-modules" in m and "service" not in m:
-        for mod in m["usage-modules"]:
-          status.append(module_manager.get_module_status(mod))
-      elif "service" in m:
-        status.append(service_status_to_module_status(service_manager.get_status(m['service'])))
-        if status[0] == powerSaver.ModuleStatus.NEEDS_CHECK:
-          status.clear()
-          for mod in m["usage-modules"]:
-            status.append(module_manager.get_module_status(mod))
-      if powerSaver.ModuleStatus.LOADED in status or powerSaver.ModuleStatus.USED in status:
-        if powerSaver.ModuleStatus.NOT_LOADED in status:
-          m['status'] = powerSaver.ModuleStatus.PARTIAL
-        else:
-          if powerSaver.ModuleStatus.USED in status:
-            m['status'] = powerSaver.ModuleStatus.USED
-          else:
-            m['status'] = powerSaver.ModuleStatus.LOADED
-      else:
-        m['status'] = powerSaver.ModuleStatus.NOT_LOADED
-  return processes, active_processes, services, modules, max_len
+    p["status"] = process_entry_status(p, process_manager)
+  return process_manager
+
+
+def load_cpufreq(cpufreq: List[Dict[str, Union[str, int, powerSaver.CpuFreqStatus]]],
+                 sudo: bool,
+                 helper: Optional[powerSaver.PrivilegedHelper]) -> powerSaver.CpuFreqManager:
+  cpufreq_manager = powerSaver.CpuFreqManager(sudo, helper=helper)
+  update_cpufreq_status(cpufreq, cpufreq_manager)
+  return cpufreq_manager
+
+
+def load_devices(devices: List[Dict[str, Union[str, List[str], powerSaver.DeviceStatus]]],
+                 sudo: bool,
+                 helper: Optional[powerSaver.PrivilegedHelper]) -> powerSaver.DevicePowerManager:
+  device_manager = powerSaver.DevicePowerManager(sudo, helper=helper)
+  update_device_status(devices, device_manager)
+  return device_manager
+
+
+def execute_process_action(entry: Dict[str, Union[str, List[str], powerSaver.ProcessStatus]],
+                           stop: bool,
+                           process_manager: powerSaver.ProcessManager,
+                           cgroup_manager: Optional[powerSaver.CgroupManager]) -> Tuple[powerSaver.ProcessStatus, str]:
+  if cgroup_manager is not None:
+    process_manager.update_processes_information()
+    cgroup_manager.move_pids(entry["title"], entry_pids(process_manager, entry))
+    if stop:
+      success = cgroup_manager.freeze(entry["title"])
+    else:
+      success = cgroup_manager.thaw(entry["title"])
+  else:
+    success = process_manager.signal_process_group(entry["name"], entry.get("cmdline"), stop,
+                                                   bool(entry.get("tree", False)))
+  process_manager.update_tracked_processes()
+  return process_entry_status(entry, process_manager), "" if success else f"Signal({entry['title']}) "
+
+
+def execute_discovery_action(entry: Dict[str, Union[str, List[str], powerSaver.ProcessStatus]],
+                             stop: bool,
+                             process_manager: powerSaver.ProcessManager) -> Tuple[powerSaver.ProcessStatus, str]:
+  success = process_manager.signal_processes(entry["title"], None, stop)
+  # Unconfigured names are not tracked, only a full scan sees their new state
+  process_manager.update_processes_information()
+  return process_entry_status(entry, process_manager), "" if success else f"Signal({entry['title']}) "
 
 
-def execute_service_thread(service_manager: powerSaver.ServiceManager, name: str, stop: bool) -> None:
+def execute_service_action(entry: Dict[str, Union[str, List[str], powerSaver.ServiceStatus]],
+                           stop: bool,
+                           service_manager: powerSaver.ServiceManager,
+                           module_manager:  powerSaver.ModuleManager) -> Tuple[powerSaver.ServiceStatus, str]:
   if stop:
-    service_manager.stop_service(name)
+    service_manager.stop_service(entry["name"])
   else:
-    service_manager.start_service(name)
+    service_manager.start_service(entry["name"])
+  return service_entry_status(entry, service_manager, module_manager), ""
+
+
+def execute_module_action(entry: Dict[str, Union[str, List[str], powerSaver.ModuleStatus]],
+                          load: bool,
+                          service_manager: powerSaver.ServiceManager,
+                          module_manager:  powerSaver.ModuleManager) -> Tuple[powerSaver.ModuleStatus, str]:
+  error_msg = ""
+  if load:
+    for module in entry["modules"]:
+      module_manager.load_module(module)
+  else:
+    for module in reversed(entry["modules"]):
+      module_status = module_manager.get_module_status(module)
+      if module_status == powerSaver.ModuleStatus.LOADED:
+        module_manager.unload_module(module)
+      elif module_status == powerSaver.ModuleStatus.USED and module in entry["usage-modules"]:
+        error_msg += f"ModUsed({module}) "
+  module_manager.update_modules_list()
+  return module_entry_status(entry, service_manager, module_manager), error_msg
+
+
+def execute_cpufreq_action(entry: Dict[str, Union[str, int, powerSaver.CpuFreqStatus]],
+                           cpufreq_manager: powerSaver.CpuFreqManager) -> Tuple[powerSaver.CpuFreqStatus, str]:
+  success = cpufreq_manager.apply(entry)
+  return cpufreq_manager.get_status(entry), "" if success else f"CpuFreq({entry['title']}) "
+
+
+def execute_device_action(entry: Dict[str, Union[str, List[str], powerSaver.DeviceStatus]],
+                          auto: bool,
+                          device_manager: powerSaver.DevicePowerManager) -> Tuple[powerSaver.DeviceStatus, str]:
+  success = device_manager.set_control(entry, auto)
+  return device_manager.get_status(entry), "" if success else f"DevicePower({entry['title']}) "
+
+
+def execute_profile_action(plan: powerSaver.ProfilePlan) -> Tuple[Optional[powerSaver.ProfileStatus], str]:
+  results = plan.run()
+  failed = [key for key, success in results.items() if not success]
+  if len(failed) > 0:
+    return None, f"Profile({plan.title}: {', '.join(failed)}) "
+  return None, ""
+
+
+def apply_finished_actions(finished: List[Tuple[str, Tuple[Optional[Enum], str]]],
+                           sections: Dict[str, List[Dict[str, Any]]]) -> Tuple[bool, str]:
+  # Targeted refresh: the actions already return the new status of their entry
+  needs_refresh = False
+  error_msg = ""
+  for key, (status, action_error_msg) in finished:
+    section, title = key.split("/", 1)
+    error_msg += action_error_msg
+    if section == "profiles":
+      needs_refresh = True
+      continue
+    for entry in sections[section]:
+      if entry["title"] == title and status is not None:
+        entry["status"] = status
+  return needs_refresh, error_msg
+
+
+def pending_title(title: str, action_queue: powerSaver.ActionQueue, key: str) -> str:
+  if action_queue.is_pending(key):
+    return title + " ..."
+  return title
+
+
+def update_cpufreq_status(cpufreq: List[Dict[str, Union[str, int, powerSaver.CpuFreqStatus]]],
+                          cpufreq_manager: powerSaver.CpuFreqManager) -> None:
+  for c in cpufreq:
+    c["status"] = cpufreq_manager.get_status(c)
+
+
+def update_device_status(devices: List[Dict[str, Union[str, List[str], powerSaver.DeviceStatus]]],
+                         device_manager: powerSaver.DevicePowerManager) -> None:
+  device_manager.update_runtime_status(devices)
+  for d in devices:
+    d["status"] = device_manager.get_status(d)
+
+
+def process_title(process: Dict[str, Union[str, List[str], powerSaver.ProcessStatus]], max_len: int) -> str:
+  if process.get("wakeups") is None:
+    return process["title"]
+  return f"{process['title']:<{max_len}} {process['wakeups']:6.0f}/s"
+
+
+def sort_processes(processes: List[Dict[str, Union[str, List[str], powerSaver.ProcessStatus]]],
+                   by_wakeups: bool) -> List[Dict[str, Union[str, List[str], powerSaver.ProcessStatus]]]:
+  if not by_wakeups:
+    return processes
+  return sorted(processes, key=lambda p: -(p.get("wakeups") or 0.0))
 
 
-def cleanup_executive_futures(in_futures: List[concurrent.futures.Future]) -> List[concurrent.futures.Future]:
-  output = []
-  for f in in_futures:
-    if not f.done():
-      output.append(f)
+def discovery_entries(process_manager: powerSaver.ProcessManager,
+                      count: int) -> List[Dict[str, Union[str, List[str], float, powerSaver.ProcessStatus]]]:
+  entries = []
+  for name, usage in process_manager.get_top_consumers(count):
+    entry = {"title": name, "name": [name], "cpu": usage}
+    entry["status"] = process_entry_status(entry, process_manager)
+    entries.append(entry)
+  return entries
+
+
+def discovery_title(entry: Dict[str, Union[str, List[str], float, powerSaver.ProcessStatus]], max_len: int) -> str:
+  return f"{entry['title']:<{max_len}} {entry['cpu'] * 100.0:5.1f}%"
+
+
+def device_title(device: Dict[str, Union[str, List[str], powerSaver.DeviceStatus]],
+                 device_manager: powerSaver.DevicePowerManager) -> str:
+  suspended, total = device_manager.get_suspended(device)
+  return f"{device['title']} ({suspended}/{total} suspended)"
+
+
+def update_profile_status(profiles: List[Dict[str, Union[str, Dict[str, str], powerSaver.ProfileStatus]]],
+                          action_queue: powerSaver.ActionQueue,
+                          processes, services, modules, cpufreq, devices) -> None:
+  for p in profiles:
+    if action_queue.is_pending("profiles/" + p["title"]):
+      p["status"] = powerSaver.ProfileStatus.APPLYING
     else:
-      f.result()
-  return output
+      p["status"] = powerSaver.get_profile_status(p, processes, services, modules, cpufreq, devices)
+
+
+def watched_process_names(processes: List[Dict[str, Union[str, List[str], powerSaver.ProcessStatus]]]) -> List[str]:
+  names = []
+  for p in processes:
+    names += p["name"]
+  return names
+
+
+def entry_pids(process_manager: powerSaver.ProcessManager,
+               entry: Dict[str, Union[str, List[str], powerSaver.ProcessStatus]]) -> List[int]:
+  return process_manager.get_group_pids(entry["name"], entry.get("cmdline"), bool(entry.get("tree", False)))
+
+
+def apply_group_status(processes: List[Dict[str, Union[str, List[str], powerSaver.ProcessStatus]]],
+                       throttler: powerSaver.ProcessThrottler,
+                       cgroup_manager: Optional[powerSaver.CgroupManager]) -> None:
+  for p in processes:
+    if p.get("status", powerSaver.ProcessStatus.NO_PROC) == powerSaver.ProcessStatus.NO_PROC:
+      continue
+    if throttler.is_throttled(p["title"]):
+      p["status"] = powerSaver.ProcessStatus.THROTTLED
+    elif cgroup_manager is not None and cgroup_manager.has_group(p["title"]):
+      # Frozen cgroup members are not SIGSTOPped, so the process table cannot tell
+      if cgroup_manager.is_frozen(p["title"]):
+        p["status"] = powerSaver.ProcessStatus.STOPPED
+      elif cgroup_manager.get_cpu_max(p["title"]) is not None:
+        p["status"] = powerSaver.ProcessStatus.THROTTLED
+
+
+def execute_throttle_action(entry: Dict[str, Union[str, List[str], powerSaver.ProcessStatus]],
+                            throttle: bool,
+                            process_manager: powerSaver.ProcessManager,
+                            throttler: powerSaver.ProcessThrottler,
+                            cgroup_manager: Optional[powerSaver.CgroupManager]) -> Tuple[powerSaver.ProcessStatus, str]:
+  if not throttle:
+    if cgroup_manager is not None:
+      success = cgroup_manager.set_cpu_max(entry["title"], None)
+    else:
+      success = throttler.remove(entry["title"])
+    status = powerSaver.ProcessStatus.RUNNING
+  else:
+    process_manager.update_processes_information()
+    run, period = config.throttle(entry)
+    if cgroup_manager is not None:
+      # cpu.max gives the same average share without stopping the processes
+      success = cgroup_manager.move_pids(entry["title"], entry_pids(process_manager, entry)) and \
+                cgroup_manager.thaw(entry["title"]) and \
+                cgroup_manager.set_cpu_max(entry["title"], run / period)
+    else:
+      success = throttler.add(entry["title"], entry_pids(process_manager, entry), run, period)
+    status = powerSaver.ProcessStatus.THROTTLED
+  return status, "" if success else f"Throttle({entry['title']}) "
+
+
+# Section -> (divider before the block, divider after the block)
+menu_dividers = {
+  "processes": (False, True),
+  "services":  (False, True),
+  "cpufreq":   (True, False),
+  "devices":   (True, False),
+  "profiles":  (True, False),
+  "discovery": (True, False),
+}
+
+menu_section_labels = {
+  "processes": "Processes",
+  "services":  "Services",
+  "modules":   "Modules",
+  "cpufreq":   "CPU",
+  "devices":   "Devices",
+  "profiles":  "Profiles",
+  "discovery": "Discovery",
+}
+
+# Startup tasks the rows of a section wait for, sections not listed wait for all of them
+startup_section_tasks = {
+  "processes": ["processes"],
+  "services":  ["status"],
+  "modules":   ["status"],
+  "cpufreq":   ["cpufreq"],
+  "devices":   ["devices"],
+}
+
+
+def menu_row_visible(section: str, entry: Dict[str, Any]) -> bool:
+  return section != "processes" or entry.get("status") != powerSaver.ProcessStatus.NO_PROC
+
+
+def menu_row_selectable(section: str, entry: Dict[str, Any]) -> bool:
+  if section == "services":
+    return entry.get("status") not in [powerSaver.ServiceStatus.NOT_FOUND, powerSaver.ServiceStatus.NO_MODULES]
+  return True
+
+
+def menu_row_text(row: powerSaver.MenuRow,
+                  action_queue: powerSaver.ActionQueue,
+                  device_manager: powerSaver.DevicePowerManager,
+                  max_len: int) -> Tuple[str, Tuple[int, int]]:
+  entry = row.entry
+  if row.section == "processes":
+    return pending_title(process_title(entry, max_len), action_queue, row.key()), process_color(entry["status"])
+  if row.section == "services":
+    return pending_title(entry["title"], action_queue, row.key()), service_color(entry["status"])
+  if row.section == "modules":
+    return pending_title(entry["title"], action_queue, row.key()), module_color(entry["status"])
+  if row.section == "cpufreq":
+    return pending_title(entry["title"], action_queue, row.key()), cpufreq_color(entry["status"])
+  if row.section == "devices":
+    return pending_title(device_title(entry, device_manager), action_queue, row.key()), device_color(entry["status"])
+  if row.section == "discovery":
+    return pending_title(discovery_title(entry, max_len), action_queue, row.key()), process_color(entry["status"])
+  return entry["title"], profile_color(entry["status"])
+
+
+def filter_key(k: int, menu: powerSaver.MenuModel) -> bool:
+  # Returns whether the filter is still being typed
+  if k == 27:  # Escape
+    menu.set_filter("")
+    return False
+  if k in [curses.KEY_ENTER, ord('\n'), ord('\r')]:
+    return False
+  if k in [curses.KEY_BACKSPACE, 127, 8]:
+    menu.set_filter(menu.filter_text[:-1])
+  elif 32 <= k < 127:
+    menu.set_filter(menu.filter_text + chr(k))
+  return True
+
+
+def draw_line(std_screen: curses.window, y: int, line: Tuple):
+  kind = line[0]
+  if kind == "text":
+    _, text, attr = line
+    std_screen.addstr(y, 0, text, attr)
+  elif kind == "entry":
+    _, text, text_format, offset = line
+    menu_entry(std_screen, y, text, text_format, offset)
+  elif kind == "message":
+    _, message, max_width = line
+    formatted_message = powerSaver.FormattedMessage()
+    formatted_message += list(message)
+    formatted_message.display(std_screen, y, 0, max_width=max_width)
+
+
+def update_lines(std_screen: curses.window, drawn: Dict[int, Tuple], lines: Dict[int, Tuple]):
+  # Only lines that changed since the last frame are touched
+  for y in [y for y in drawn if y not in lines]:
+    std_screen.move(y, 0)
+    std_screen.clrtoeol()
+    del drawn[y]
+  for y, line in lines.items():
+    if drawn.get(y) == line:
+      continue
+    std_screen.move(y, 0)
+    std_screen.clrtoeol()
+    draw_line(std_screen, y, line)
+    drawn[y] = line
+
+
+def show_startup(std_screen: curses.window,
+                 poll_object: select.poll,
+                 loader: powerSaver.StartupLoader,
+                 menu: powerSaver.MenuModel,
+                 sections: List[Tuple[str, List[Dict[str, Any]]]],
+                 action_queue: powerSaver.ActionQueue,
+                 title: str) -> Tuple[int, int]:
+  # Shows the menu with placeholder rows until every startup task has finished,
+  # rows are filled in as soon as the tasks they wait for are done.
+  # Returns the last key and the title width.
+  max_len = len(title)
+  for section, entries in sections:
+    if section in ["processes", "services", "modules"]:
+      max_len = max([max_len] + [len(e["title"]) for e in entries])
+  poll_object.register(loader.fileno(), select.POLLIN)
+  drawn_lines: Dict[int, Tuple] = {}
+  drawn_size = (0, 0)
+  loaded: Optional[Set[str]] = None
+  k = 0
+  while k != ord('q') and not loader.all_done():
+    finished = set(loader.poll())
+    if finished != loaded:
+      loaded = finished
+      menu.rebuild(sections, menu_row_visible, menu_row_selectable, menu_dividers)
+    height, width = std_screen.getmaxyx()
+    menu.set_height(height - 4)
+    if (height, width) != drawn_size:
+      std_screen.clear()
+      drawn_lines = {}
+      drawn_size  = (height, width)
+
+    lines = {
+      0: ("text", title[:width - 1], curses.A_BOLD),
+      1: ("text", "-" * min(width - 1, max_len), curses.A_BOLD),
+    }
+    device_manager = loader.result("devices") if "devices" in loaded else None
+    for y, row in menu.visible_rows():
+      if row.is_divider():
+        lines[y + 2] = ("text", "-" * min(width - 1, max_len), curses.A_NORMAL)
+      elif loaded.issuperset(startup_section_tasks.get(row.section, loader.tasks)):
+        text, text_format = menu_row_text(row, action_queue, device_manager, max_len)
+        lines[y + 2] = ("entry", text[:width - 1], text_format, color_offset(menu.is_selected(row)))
+      else:
+        lines[y + 2] = ("entry", f"{row.entry['title']:<{max_len}} loading"[:width - 1], (2, curses.A_DIM), 0)
+
+    status_msg = powerSaver.FormattedMessage()
+    status_msg += [("Q", curses.A_BOLD),
+                   ("uit | loading: ", curses.A_NORMAL),
+                   (" ".join(loader.pending()), curses.color_pair(2))]
+    if config.debug():
+      status_msg += [(" | ", curses.A_NORMAL),
+                     (f"startup: {loader.elapsed():.2f}s", curses.color_pair(4))]
+    power_status_msg = powerSaver.FormattedMessage()
+    power_status_msg += [("Battery: ", curses.A_NORMAL)]
+    if "power" in loaded and loader.result("power").working:
+      _, battery_percent, _, _, _ = loader.result("power").get_current_stats()
+      power_status_msg += [(f"{battery_percent:5.1f}%", battery_percent_color(battery_percent))]
+    else:
+      power_status_msg += [("loading", curses.color_pair(2))]
+    lines[height - 1] = ("message", tuple(status_msg.message), width - 1)
+    lines[height - 2] = ("message", tuple(power_status_msg.message), width - 1)
+    update_lines(std_screen, drawn_lines, lines)
+    std_screen.refresh()
+
+    # Woken up by a key or by a finished task
+    poll_object.poll()
+    k = std_screen.getch()
+  poll_object.unregister(loader.fileno())
+  return k, max_len
 
 
-def draw_menu(std_screen: curses.window):
+def exit_on_signal(signum, frame):
+  sys.exit(0)
+
+
+def sync_poll_fds(poll_object: select.poll, registered: Set[int], fds: List[int]) -> Set[int]:
+  current = set(fds)
+  for fd in registered - current:
+    poll_object.unregister(fd)
+  for fd in current - registered:
+    poll_object.register(fd, select.POLLIN)
+  return current
+
+
+def draw_menu(std_screen: curses.window, helper: Optional[powerSaver.PrivilegedHelper] = None):
   poll_object = select.poll()
   poll_object.register(sys.stdin, select.POLLIN)
 
   default_refresh_rate, default_power_sampling_rate, refresh_maximum = config.refresh()
+  rescan = config.rescan()
   processes = config.processes()
   services  = config.services()
   modules   = config.modules()
+  cpufreq   = config.cpufreq()
+  devices   = config.devices()
+  profiles  = config.profiles()
+  refresh   = default_refresh_rate
+
+  # The first scans run while the frame is set up, in submission order when
+  # recording or replaying, so every input is read in the same order
+  loader       = powerSaver.StartupLoader(1 if powerSaver.snapshot.is_active() else 8)
+  status_graph = powerSaver.StatusGraph(services, modules)
+  loader.submit("processes", load_processes, processes, config.use_sudo(), helper)
+  loader.submit("services", powerSaver.ServiceManager, config.init_system(), config.use_sudo(), config.debug(),
+                helper=helper)
+  loader.submit("modules", powerSaver.ModuleManager, config.use_sudo(), helper=helper)
+  loader.submit("power", powerSaver.PowerStats, refresh, config.power_sys_class_path())
+  loader.submit("rapl", powerSaver.RaplReader)
+  loader.submit("cpufreq", load_cpufreq, cpufreq, config.use_sudo(), helper)
+  loader.submit("devices", load_devices, devices, config.use_sudo(), helper)
+  # A single worker would wait on itself for the service states
+  loader.submit("status", status_graph.refresh, needs=("services", "modules"),
+                executor=None if powerSaver.snapshot.is_active() else loader.executor)
 
   k = 0
-  cursor_y            = 0
-  refresh             = default_refresh_rate
   power_sampling_rate = default_power_sampling_rate
 
   effective_power_sampling_rate = power_sampling_rate
 
-  last_update_display = datetime.now() - timedelta(seconds=refresh*2)
-  last_update_power   = datetime.now() - timedelta(seconds=power_sampling_rate*2)
-
   std_screen.clear()
   std_screen.refresh()
   std_screen.nodelay(True)
   curses.curs_set(0)
-
-  with concurrent.futures.ProcessPoolExecutor(max_workers=3) as process_pool:
+  if hasattr(curses, "set_escdelay"):
+    # Escape leaves the filter, without waiting a second for an escape sequence
+    curses.set_escdelay(25)
+
+  # Recording and replaying happen in this process, so the menu has to be calculated in threads
+  replaying = powerSaver.snapshot.is_replaying()
+  if powerSaver.snapshot.is_active():
+    pool_class = concurrent.futures.ThreadPoolExecutor
+  else:
+    pool_class = concurrent.futures.ProcessPoolExecutor
+  with pool_class(max_workers=3) as process_pool:
     futures_type = Optional[concurrent.futures.Future]
     update_menu_structure_future: futures_type = None
-    execute_futures: List[concurrent.futures.Future] = []
+    menu_changes           = 0  # Finished actions and added entries, a menu calculated before them is outdated
+    menu_submitted_changes = 0
+    # Service and module states are queried in this process, so they can use the helper
+    status_pool = concurrent.futures.ThreadPoolExecutor(max_workers=8)
+    status_future: futures_type = None
+    status_submitted_changes = 0
+    action_queue = powerSaver.ActionQueue()
+    poll_object.register(action_queue.fileno(), select.POLLIN)
 
     # Colors
     if not curses.has_colors():
@@ -302,34 +707,128 @@ def draw_menu(std_screen: curses.window):
     curses.init_pair(17, curses.COLOR_BLACK, curses.COLOR_RED)
     curses.init_pair(17+8, curses.COLOR_BLUE, curses.COLOR_RED)
 
-    process_manager = powerSaver.ProcessManager(config.use_sudo())
-    service_manager = powerSaver.ServiceManager(config.init_system(), config.use_sudo(), config.debug())
-    module_manager  = powerSaver.ModuleManager(config.use_sudo())
-    power_stats     = powerSaver.PowerStats(refresh, config.power_sys_class_path())
-
     height, width = std_screen.getmaxyx()
     title = f"{application_name} v{version}"
-    active_processes: List[Dict[str, Union[str, List[str], powerSaver.ProcessStatus]]] = []
-    max_len = len(title)
+    menu  = powerSaver.MenuModel(height - 4)
+    menu_sections = [("processes", processes), ("services", services), ("modules", modules),
+                     ("cpufreq", cpufreq), ("devices", devices), ("profiles", profiles)]
+    k, max_len = show_startup(std_screen, poll_object, loader, menu, menu_sections, action_queue, title)
+    # Service and module titles do not change, only process titles are measured again
+    fixed_titles_len = max([len(title)] + [len(e["title"]) for e in services + modules])
+    if k == ord('q'):
+      loader.shutdown()
+      action_queue.shutdown()
+      return
+
+    process_manager = loader.result("processes")
+    service_manager = loader.result("services")
+    module_manager  = loader.result("modules")
+    power_stats     = loader.result("power")
+    rapl            = loader.result("rapl")
+    cpufreq_manager = loader.result("cpufreq")
+    device_manager  = loader.result("devices")
+    loader.result("status")
+    startup_seconds = loader.elapsed()
+    startup_slowest = max(loader.finished, key=loader.finished.get)
+    loader.shutdown()
+
+    sampler         = powerSaver.PowerSampler(config.power_sys_class_path(), rapl, config.power_sample_interval())
+    if not powerSaver.snapshot.is_active():
+      # Samples from a thread would not line up with the recorded UI loop
+      sampler.start()
+    exporter        = powerSaver.MetricsExporter(config.export_json(), config.export_prometheus(),
+                                                 config.export_flush_interval())
+    publisher       = powerSaver.StatusPublisher(config.status_file())
+    throttler       = powerSaver.ProcessThrottler(process_manager)
+    cgroup_manager: Optional[powerSaver.CgroupManager] = None
+    if config.process_backend() == "cgroup":
+      cgroup_manager = powerSaver.CgroupManager(config.cgroup_root(), config.use_sudo(), helper=helper)
+      atexit.register(cgroup_manager.release_all)
+    profile_actions = powerSaver.ProfileActions(process_manager, service_manager, module_manager,
+                                                cpufreq_manager, device_manager, cgroup_manager)
+    atexit.register(throttler.release_all)
+
+    # Title and divider on top, the power chart and two status lines at the bottom
+    chart_rows    = 1 if power_stats.working else 0
+    sparkline     = powerSaver.Sparkline(width - 1, config.power_colors()[3], power_use_color,
+                                         powerSaver.sparkline.block_ramp if "utf" in std_screen.encoding.lower()
+                                         else powerSaver.sparkline.ascii_ramp)
+    menu_dirty    = True
+    filter_typing = False
+    sort_by_wakeups = False
+    discovery_view  = False
+    discovered: List[Dict[str, Union[str, List[str], float, powerSaver.ProcessStatus]]] = []
+    drawn_lines: Dict[int, Tuple] = {}
+    drawn_size    = (0, 0)
+
+    # The startup already did the first full scan and power read
+    last_update_display = datetime.now()
+    last_update_power   = datetime.now()
+    last_process_scan   = datetime.now()
+    registered_pidfds = sync_poll_fds(poll_object, set(), process_manager.get_poll_fds())
+    processes_exited  = False
 
     first_loop = True
-    while k != ord('q'):
+    replay_remaining = -1
+    while k != ord('q') or filter_typing:
       now = datetime.now()
-
-      execute_futures = cleanup_executive_futures(execute_futures)
-
+      if replaying:
+        # Every loop is a full refresh, until the snapshot stops being consumed
+        if powerSaver.snapshot.replay_finished() or powerSaver.snapshot.replay_remaining() == replay_remaining:
+          break
+        replay_remaining    = powerSaver.snapshot.replay_remaining()
+        last_update_display = now - timedelta(seconds=refresh*2)
+        last_update_power   = now - timedelta(seconds=effective_power_sampling_rate*2)
+
+      recalculate_menu   = False
+      recalculate_status = False
+      if status_future is not None and status_future.done():
+        status_future.result()
+        status_future = None
+        menu_dirty = True
+        # The graph writes the states of all its entries, including the ones an action just set
+        recalculate_status = status_submitted_changes != menu_changes
       if update_menu_structure_future is not None and update_menu_structure_future.done():
-        processes, active_processes, services, modules, max_len = update_menu_structure_future.result()
+        if menu_submitted_changes == menu_changes:
+          processes, max_len = update_menu_structure_future.result()
+          apply_group_status(processes, throttler, cgroup_manager)
+          menu_dirty = True
+        else:
+          # Calculated from the entries before an action or a new entry, it would undo them
+          recalculate_menu = True
+        update_menu_structure_future = None
+
+      finished_actions = action_queue.poll()
+      needs_refresh, action_error_msg = apply_finished_actions(finished_actions, {
+        "processes": processes, "services": services, "modules": modules, "cpufreq": cpufreq, "devices": devices,
+        "discovery": discovered,
+      })
+      apply_group_status(processes, throttler, cgroup_manager)
+      if len(finished_actions) > 0:
+        menu_dirty = True
+        menu_changes += 1
+      if needs_refresh:
+        # A profile touches many entries, show its result right away
+        last_update_display = now - timedelta(seconds=refresh*2)
 
       toggle              = False
+      throttle_toggle     = False
+      add_to_config       = False
+      power_refreshed     = False
       skip_render_menu    = True
       skip_calculate_menu = True
       skip_render_power   = True
 
-      if k == curses.KEY_DOWN:
-        cursor_y = cursor_y + 1
+      if filter_typing and k > 0 and k not in [curses.KEY_DOWN, curses.KEY_UP, curses.KEY_NPAGE, curses.KEY_PPAGE]:
+        filter_typing = filter_key(k, menu)
+      elif k == curses.KEY_DOWN:
+        menu.move(1)
       elif k == curses.KEY_UP:
-        cursor_y = cursor_y - 1
+        menu.move(-1)
+      elif k == curses.KEY_NPAGE:
+        menu.page(1)
+      elif k == curses.KEY_PPAGE:
+        menu.page(-1)
       elif k == ord('+'):
         refresh += 1
       elif k == ord('-'):
@@ -342,22 +841,54 @@ def draw_menu(std_screen: curses.window):
         power_sampling_rate -= 1
         if effective_power_sampling_rate == power_sampling_rate:
           effective_power_sampling_rate -= 1
-      elif k in [curses.KEY_ENTER, ord('\n'), ord(' '), ord('\r')]:
+      # A replay shows recorded state, changing the live system from it would act on other processes
+      elif k in [curses.KEY_ENTER, ord('\n'), ord(' '), ord('\r')] and not replaying:
         toggle = True
+      elif k == ord('t') and not replaying:
+        throttle_toggle = True
+      elif k == ord('/'):
+        filter_typing = True
+      elif k == ord('s'):
+        sort_by_wakeups = not sort_by_wakeups
+        menu_dirty = True
+      elif k == ord('d'):
+        discovery_view = not discovery_view
+        menu_dirty = True
+      elif k == ord('a') and not replaying:
+        add_to_config = True
+      elif k == 27:
+        menu.set_filter("")
 
       # Update caches
       if last_update_display + timedelta(seconds=refresh) < now:
         last_update_display = now
-        process_manager.update_processes_information()
+        if last_process_scan + timedelta(seconds=rescan) < now:
+          last_process_scan = now
+          process_manager.update_processes_information()
+          device_manager.update_index()
+        else:
+          process_manager.update_tracked_processes()
+        for p in processes:
+          if throttler.is_throttled(p["title"]):
+            throttler.update_pids(p["title"], entry_pids(process_manager, p))
+          elif cgroup_manager is not None and cgroup_manager.has_group(p["title"]):
+            cgroup_manager.move_pids(p["title"], entry_pids(process_manager, p))
         module_manager.update_modules_list()
+        cpufreq_manager.update_status()
+        update_cpufreq_status(cpufreq, cpufreq_manager)
+        update_device_status(devices, device_manager)
         skip_render_menu    = False
         skip_calculate_menu = False
-      elif k >= 0:
+      elif processes_exited:
+        skip_render_menu    = False
+        skip_calculate_menu = False
+      elif k >= 0 or len(finished_actions) > 0:
         skip_render_menu = False
 
       if last_update_power + timedelta(seconds=effective_power_sampling_rate) < now:
         last_update_power = now
         power_stats.refresh_status()
+        power_refreshed   = True
         skip_render_power = False
       elif k != 0:
         skip_render_power = False
@@ -374,119 +905,164 @@ def draw_menu(std_screen: curses.window):
       if k > 0:
         skip_render_menu = False
 
-      if not skip_calculate_menu:
-        height, width       = std_screen.getmaxyx()
-
+      if not skip_calculate_menu or recalculate_menu:
         # Strings
+        menu_submitted_changes = menu_changes
         update_menu_structure_future = process_pool.submit(calculate_menu_thread,
-                                                           processes, services, modules,
-                                                           process_manager, service_manager, module_manager,
-                                                           refresh, title, last_update_display)
-
-        if first_loop:
-          processes, active_processes, services, modules, max_len = update_menu_structure_future.result()
-      if not skip_calculate_menu or k in [curses.KEY_UP, curses.KEY_DOWN]:
-        not_found = 0
-        for y, s in enumerate(services):
-          if s["status"] in [powerSaver.ServiceStatus.NOT_FOUND, powerSaver.ServiceStatus.NO_MODULES]:
-            not_found += 1
-            if cursor_y - len(active_processes) == y:
-              if k == curses.KEY_UP:
-                cursor_y -= not_found
-              else:
-                cursor_y += not_found
-          else:
-            not_found = 0
-
-      if k > 0:
-        cursor_y = min(len(active_processes) + len(services) + len(modules) - 1, max(0, cursor_y))
+                                                           processes, process_manager, fixed_titles_len)
+
+        if replaying:
+          processes, max_len = update_menu_structure_future.result()
+          update_menu_structure_future = None
+          apply_group_status(processes, throttler, cgroup_manager)
+          menu_dirty = True
+
+      if status_future is None and (not skip_calculate_menu or recalculate_status):
+        status_submitted_changes = menu_changes
+        # Snapshots query one service after the other, as for the startup
+        status_future = status_pool.submit(status_graph.refresh, service_manager, module_manager,
+                                           None if powerSaver.snapshot.is_active() else status_pool)
+        if replaying:
+          status_future.result()
+          status_future = None
+          menu_dirty = True
+
+      status_changed = power_refreshed or menu_dirty
+      if menu_dirty and discovery_view:
+        discovered = discovery_entries(process_manager, config.discovery_top())
+        menu.rebuild([("discovery", discovered)], menu_row_visible, menu_row_selectable, menu_dividers)
+        menu_dirty = False
+      elif menu_dirty:
+        menu.rebuild([("processes", sort_processes(processes, sort_by_wakeups)), ("services", services), ("modules", modules),
+                      ("cpufreq", cpufreq), ("devices", devices), ("profiles", profiles)],
+                     menu_row_visible, menu_row_selectable, menu_dividers)
+        menu_dirty = False
+
+      # The sampler has the current draw without any reads here, None while it is not running
+      sampled_battery_watts, sampled_rapl_watts = sampler.average(2.0)
+
+      if status_changed and (exporter.enabled() or publisher.enabled()):
+        sample = powerSaver.build_sample(power_stats, {
+          "processes": processes, "services": services, "modules": modules,
+          "cpufreq": cpufreq, "devices": devices, "profiles": profiles,
+        }, rapl, sampled_battery_watts)
+        if power_refreshed:
+          exporter.record(sample)
+        publisher.publish(sample)
 
       # Execute action
-      error_msg = ""
+      error_msg = action_error_msg
       section   = ""
-      if toggle:
-        if cursor_y < len(active_processes):  # Processes
-          section = "Processes->" + active_processes[cursor_y]["title"]
-          status = active_processes[cursor_y]["status"]
-          for name in active_processes[cursor_y]["name"]:
-            cmdline_filter = None
-            if "cmdline" in active_processes[cursor_y]:
-              cmdline_filter = active_processes[cursor_y]["cmdline"]
-            if status in [powerSaver.ProcessStatus.STOPPED, powerSaver.ProcessStatus.MANY]:
-              process_manager.signal_processes(name, cmdline_filter, False)
-            elif status == powerSaver.ProcessStatus.RUNNING:
-              process_manager.signal_processes(name, cmdline_filter, True)
-        elif cursor_y - len(active_processes) < len(services):  # Services
-          cursor = cursor_y - len(active_processes)
-          section = "Services->" + services[cursor]["title"]
-          status = services[cursor]["status"]
+      selected = menu.selected()
+      if selected is not None and (toggle or throttle_toggle):
+        section = menu_section_labels[selected.section] + "->" + selected.entry["title"]
+      if toggle and selected is not None:
+        entry  = selected.entry
+        key    = selected.key()
+        status = entry.get("status")
+        if selected.section == "processes":
+          if status == powerSaver.ProcessStatus.THROTTLED:
+            action_queue.submit(key, ("throttle", False), execute_throttle_action, entry, False,
+                                process_manager, throttler, cgroup_manager)
+          elif status in [powerSaver.ProcessStatus.STOPPED, powerSaver.ProcessStatus.MANY,
+                          powerSaver.ProcessStatus.RUNNING]:
+            stop = status == powerSaver.ProcessStatus.RUNNING
+            action_queue.submit(key, stop, execute_process_action, entry, stop, process_manager, cgroup_manager)
+        elif selected.section == "services":
           if status in [powerSaver.ServiceStatus.STOPPED, powerSaver.ServiceStatus.CRASHED]:
-            future = process_pool.submit(execute_service_thread, service_manager, services[cursor]["name"], False)
-            execute_futures.append(future)
+            action_queue.submit(key, False, execute_service_action, entry, False, service_manager, module_manager)
           elif status in [powerSaver.ServiceStatus.RUNNING, powerSaver.ServiceStatus.INACTIVE]:
-            future = process_pool.submit(execute_service_thread, service_manager, services[cursor]["name"], True)
-            execute_futures.append(future)
-        elif cursor_y - len(active_processes) - len(services) < len(modules):  # Modules
-          cursor = cursor_y - len(active_processes) - len(services)
-          section = "Modules->" + modules[cursor]["title"]
-          status = modules[cursor]["status"]
+            action_queue.submit(key, True, execute_service_action, entry, True, service_manager, module_manager)
+        elif selected.section == "modules":
           if status in [powerSaver.ModuleStatus.LOADED, powerSaver.ModuleStatus.PARTIAL]:
-            for module in reversed(modules[cursor]["modules"]):
-              module_status = module_manager.get_module_status(module)
-              if module_status == powerSaver.ModuleStatus.LOADED:
-                module_manager.unload_module(module)
-              elif module_status == powerSaver.ModuleStatus.USED and module in modules[cursor]["usage-modules"]:
-                error_msg += f"ModUsed({module}) "
+            action_queue.submit(key, False, execute_module_action, entry, False, service_manager, module_manager)
           elif status == powerSaver.ModuleStatus.NOT_LOADED:
-            for module in modules[cursor]["modules"]:
-              module_manager.load_module(module)
+            action_queue.submit(key, True, execute_module_action, entry, True, service_manager, module_manager)
+        elif selected.section == "cpufreq":
+          if status in [powerSaver.CpuFreqStatus.INACTIVE, powerSaver.CpuFreqStatus.PARTIAL]:
+            action_queue.submit(key, True, execute_cpufreq_action, entry, cpufreq_manager)
+        elif selected.section == "devices":
+          if status in [powerSaver.DeviceStatus.ON, powerSaver.DeviceStatus.PARTIAL]:
+            action_queue.submit(key, True, execute_device_action, entry, True, device_manager)
+          elif status == powerSaver.DeviceStatus.AUTO:
+            action_queue.submit(key, False, execute_device_action, entry, False, device_manager)
+        elif selected.section == "profiles":
+          if not action_queue.is_pending(key):
+            for profile_process in entry.get("processes", {}):
+              throttler.remove(profile_process)
+            plan = powerSaver.compile_profile(entry, processes, services, modules, cpufreq, devices, profile_actions)
+            action_queue.submit(key, True, execute_profile_action, plan)
+        elif selected.section == "discovery":
+          if status in [powerSaver.ProcessStatus.STOPPED, powerSaver.ProcessStatus.MANY,
+                        powerSaver.ProcessStatus.RUNNING]:
+            stop = status == powerSaver.ProcessStatus.RUNNING
+            action_queue.submit(key, stop, execute_discovery_action, entry, stop, process_manager)
+
+      if add_to_config and selected is not None and selected.section == "discovery":
+        process_name = selected.entry["title"]
+        entry = {"title": process_name, "name": [process_name]}
+        if config.add_process(entry):
+          process_manager.watched.add(process_name)
+          existing = [p for p in processes if p["title"] == process_name]
+          if len(existing) > 0:
+            entry = existing[0]
+          else:
+            processes.append(entry)
+          entry["status"] = process_entry_status(entry, process_manager)
+          menu_dirty = True
+          menu_changes += 1
+        else:
+          error_msg += f"Config({process_name}) "
+
+      if throttle_toggle and selected is not None and selected.section == "processes" and \
+         selected.entry.get("status") != powerSaver.ProcessStatus.NO_PROC:
+        # Stop and continue use plain booleans as target, so a throttle after them is queued behind them
+        throttle = selected.entry.get("status") != powerSaver.ProcessStatus.THROTTLED
+        action_queue.submit(selected.key(), ("throttle", throttle), execute_throttle_action, selected.entry, throttle,
+                            process_manager, throttler, cgroup_manager)
 
       if (not skip_render_menu) or (not skip_render_power):
-        std_screen.clear()
-
-        # Draw Title
-        std_screen.attron(curses.A_BOLD)
-        std_screen.addstr(0, 0, title[:width - 1])
-
-        # Divider
-        std_screen.addstr(1, 0, "-" * min(width - 1, max_len))
-        std_screen.attroff(curses.A_BOLD)
-
-        n = 2
-        y_offset = 0
-
-        # Processes
-        if len(active_processes) > 0:
-          for y, p in enumerate(active_processes):
-            offset = color_offset(cursor_y == y)
-            menu_entry(std_screen, y + n, p["title"][:width-1], process_color(p["status"]), offset)
-          n += len(active_processes)
-
-          # Divider
-          std_screen.addstr(n, 0, "-" * min(width - 1, max_len))
-          n += 1
-
-        # Services
-        if len(services) > 0:
-          y_offset = len(active_processes)
-          for y, s in enumerate(services):
-            offset = color_offset(cursor_y == y + y_offset)
-            menu_entry(std_screen, y + n, s["title"][:width-1], service_color(s["status"]), offset)
-          n += len(services)
-
-          # Divider
-          std_screen.addstr(n, 0, "-" * min(width - 1, max_len))
-          n += 1
-
-        # Modules
-        if len(modules) > 0:
-          y_offset += len(services)
-          for y, m in enumerate(modules):
-            offset = color_offset(cursor_y == y + y_offset)
-            menu_entry(std_screen, y + n, m["title"][:width-1], module_color(m["status"]), offset)
+        height, width = std_screen.getmaxyx()
+        menu.set_height(height - 4 - chart_rows)
+        if (height, width) != drawn_size:
+          std_screen.clear()
+          drawn_lines = {}
+          drawn_size  = (height, width)
+          sparkline.set_width(width - 1)
+
+        # Title and divider
+        lines = {
+          0: ("text", title[:width - 1], curses.A_BOLD),
+          1: ("text", "-" * min(width - 1, max_len), curses.A_BOLD),
+        }
+
+        # Only the rows inside the viewport are drawn
+        update_profile_status(profiles, action_queue, processes, services, modules, cpufreq, devices)
+        for y, row in menu.visible_rows():
+          if row.is_divider() and row.section == "processes":
+            # Divider with the interrupts of the whole system, to compare the wakeups against
+            processes_divider = "-" * max_len
+            if process_manager.interrupt_rate is not None:
+              processes_divider = f"{'- IRQ: ':-<{max_len}} {process_manager.interrupt_rate:6.0f}/s"
+            lines[y + 2] = ("text", processes_divider[:width - 1], curses.A_NORMAL)
+          elif row.is_divider() and row.section == "discovery":
+            discovery_divider = f"{'- Unconfigured, by CPU ':-<{max_len}} "
+            lines[y + 2] = ("text", discovery_divider[:width - 1], curses.A_NORMAL)
+          elif row.is_divider() and row.section == "cpufreq":
+            # Divider with the current policy state
+            cpufreq_divider  = f"- CPU: {cpufreq_manager.summary()} "
+            cpufreq_divider += "-" * max(0, max_len - len(cpufreq_divider))
+            lines[y + 2] = ("text", cpufreq_divider[:width - 1], curses.A_NORMAL)
+          elif row.is_divider():
+            lines[y + 2] = ("text", "-" * min(width - 1, max_len), curses.A_NORMAL)
+          else:
+            text, text_format = menu_row_text(row, action_queue, device_manager, max_len)
+            lines[y + 2] = ("entry", text[:width-1], text_format, color_offset(menu.is_selected(row)))
 
         # Status
         battery_status, battery_percent, battery_watts, battery_h, battery_m = power_stats.get_current_stats()
+        if sampled_battery_watts is not None:
+          battery_watts = sampled_battery_watts
 
         if battery_status == powerSaver.BatteryStatus.DISCHARGING:
           effective_power_sampling_rate = power_sampling_rate
@@ -505,16 +1081,26 @@ def draw_menu(std_screen: curses.window):
                          (",", curses.A_BOLD),
                          (f"[{power_sampling_rate}s]", curses.A_NORMAL),
                          (".", curses.A_BOLD)]
+        if discovery_view:
+          status_msg += [(" | ", curses.A_NORMAL),
+                         ("D", curses.A_BOLD),
+                         ("iscovery: ", curses.A_NORMAL),
+                         ("A", curses.A_BOLD),
+                         ("dd to config", curses.A_NORMAL)]
+        if filter_typing or len(menu.filter_text) > 0:
+          status_msg += [(" | /", curses.A_BOLD),
+                         (menu.filter_text + ("_" if filter_typing else ""), curses.color_pair(6))]
         if config.debug():
           status_msg += [(" | ", curses.A_NORMAL),
-                         (f"cursor: {cursor_y}/{len(active_processes) + len(services) + len(modules) - 1}",
+                         (f"cursor: {menu.cursor}/{len(menu.selectable) - 1}",
                           curses.color_pair(4)),
                          (" | ", curses.A_NORMAL),
                          (f"k: {k}", curses.color_pair(6)),
                          (" | ", curses.A_NORMAL),
-                         (f"{section}", curses.color_pair(8))
+                         (f"{section}", curses.color_pair(8)),
+                         (" | ", curses.A_NORMAL),
+                         (f"startup: {startup_seconds:.2f}s ({startup_slowest})", curses.color_pair(3))
                          ]
-          # len(active_processes) + len(services) + len(modules) - 1
 
         # Power Stats
         power_status_msg = powerSaver.FormattedMessage()
@@ -526,6 +1112,11 @@ def draw_menu(std_screen: curses.window):
           power_status_msg += [(" | ", curses.A_NORMAL),
                                (f"{battery_watts:5.2f}", power_use_color(battery_watts)),
                                (f"W ({battery_h:2d}:{battery_m:02d}) ", curses.A_NORMAL)]
+        # RAPL counts the energy of the CPU package on AC as well, and much finer than the battery
+        if sampled_rapl_watts is not None:
+          power_status_msg += [(" | CPU ", curses.A_NORMAL),
+                               (f"{sampled_rapl_watts:5.2f}", power_use_color(sampled_rapl_watts)),
+                               ("W", curses.A_NORMAL)]
 
         if battery_status == powerSaver.BatteryStatus.DISCHARGING:
           power_load = power_stats.get_power_load()
@@ -557,8 +1148,12 @@ def draw_menu(std_screen: curses.window):
                          (f"{error_msg}", curses.color_pair(5))]
         status_msg += " "*min(0, width - len(status_msg) - 1)
         power_status_msg += " "*min(0, width - len(power_status_msg) - 1)
-        status_msg.display(std_screen, height - 1, 0, max_width=width-1)
-        power_status_msg.display(std_screen, height - 2, 0, max_width=width-1)
+        lines[height - 1] = ("message", tuple(status_msg.message), width - 1)
+        lines[height - 2] = ("message", tuple(power_status_msg.message), width - 1)
+        update_lines(std_screen, drawn_lines, lines)
+        if chart_rows > 0:
+          sparkline.update(power_stats.history, power_stats.history_total)
+          sparkline.draw(std_screen, height - 3)
 
         # Refresh the screen
         std_screen.refresh()
@@ -569,15 +1164,53 @@ def draw_menu(std_screen: curses.window):
       sleep_length_power = last_update_power + timedelta(seconds=effective_power_sampling_rate) - now
       sleep_length = min(sleep_length_power, sleep_length_display)
       sleep_length = math.floor(max(0.0, sleep_length.total_seconds() * 1000))
+      throttle_sleep_length = throttler.sleep_length_ms()
+      if throttle_sleep_length is not None:
+        sleep_length = min(sleep_length, throttle_sleep_length)
+      if replaying:
+        sleep_length = 0
 
       first_loop = False
 
-      # Wait for next input
-      poll_object.poll(sleep_length)
+      # Wait for next input or for a tracked process to exit
+      registered_pidfds = sync_poll_fds(poll_object, registered_pidfds, process_manager.get_poll_fds())
+      exited_pidfds     = [fd for fd, _ in poll_object.poll(sleep_length) if fd in registered_pidfds]
+      throttler.tick()
+      processes_exited  = len(exited_pidfds) > 0
+      if processes_exited:
+        process_manager.handle_exited(exited_pidfds)
       k = std_screen.getch()
 
+    throttler.release_all()
+    if cgroup_manager is not None:
+      cgroup_manager.release_all()
+    sampler.stop()
+    exporter.close()
+    publisher.close()
+    action_queue.shutdown()
+    process_manager.close()
+    status_pool.shutdown()
     process_pool.shutdown()
 
 
 if __name__ == '__main__':
-  curses.wrapper(draw_menu)
+  argument_parser = argparse.ArgumentParser(prog=application_name)
+  snapshot_group  = argument_parser.add_mutually_exclusive_group()
+  snapshot_group.add_argument("--record", metavar="FILE", help="record all system inputs to FILE")
+  snapshot_group.add_argument("--replay", metavar="FILE", help="replay recorded inputs from FILE as fast as possible")
+  arguments = argument_parser.parse_args()
+
+  config = ConfigParser(Path(default_config_file))
+  signal.signal(signal.SIGTERM, exit_on_signal)
+  signal.signal(signal.SIGHUP, exit_on_signal)
+  if arguments.record is not None:
+    powerSaver.snapshot.start_recording(arguments.record)
+  elif arguments.replay is not None:
+    powerSaver.snapshot.start_replay(arguments.replay)
+  atexit.register(powerSaver.snapshot.stop)
+  # Started before curses takes over the terminal, so sudo can ask for a password
+  privileged_helper: Optional[powerSaver.PrivilegedHelper] = None
+  if config.use_sudo() and config.privileged_helper() and arguments.replay is None:
+    privileged_helper = powerSaver.PrivilegedHelper()
+    atexit.register(privileged_helper.close)
+  curses.wrapper(draw_menu, privileged_helper)
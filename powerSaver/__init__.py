@@ -15,18 +15,80 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 
-import powerSaver.processManager
-import powerSaver.serviceManager
-import powerSaver.moduleManager
-import powerSaver.powerStats
-import powerSaver.formattedMessage
+import importlib
+from typing import Any
 
-from .processManager import ProcessManager
-from .processManager import ProcessStatus
-from .serviceManager import ServiceManager
-from .serviceManager import ServiceStatus
-from .moduleManager import ModuleManager
-from .moduleManager import ModuleStatus
-from .powerStats import PowerStats
-from .powerStats import BatteryStatus
-from .formattedMessage import FormattedMessage
+# Nothing is imported up front: the command line tools only pay for the
+# submodules (and psutil, yaml, curses, ...) they actually use
+_submodules = [
+  "processManager",
+  "serviceManager",
+  "moduleManager",
+  "powerStats",
+  "formattedMessage",
+  "throttler",
+  "cgroupManager",
+  "cpuFreqManager",
+  "devicePowerManager",
+  "profile",
+  "actionQueue",
+  "privilegedHelper",
+  "metricsExporter",
+  "snapshot",
+  "menuModel",
+  "statusGraph",
+  "raplReader",
+  "powerSampler",
+  "statusReader",
+  "statusPublisher",
+  "sparkline",
+  "startupLoader",
+]
+
+_exports = {
+  "ProcessManager":         "processManager",
+  "ProcessStatus":          "processManager",
+  "cmdline_filtered_names": "processManager",
+  "ServiceManager":         "serviceManager",
+  "ServiceStatus":          "serviceManager",
+  "ModuleManager":          "moduleManager",
+  "ModuleStatus":           "moduleManager",
+  "PowerStats":             "powerStats",
+  "BatteryStatus":          "powerStats",
+  "FormattedMessage":       "formattedMessage",
+  "ProcessThrottler":       "throttler",
+  "CgroupManager":          "cgroupManager",
+  "CpuFreqManager":         "cpuFreqManager",
+  "CpuFreqStatus":          "cpuFreqManager",
+  "DevicePowerManager":     "devicePowerManager",
+  "DeviceStatus":           "devicePowerManager",
+  "ProfileActions":         "profile",
+  "ProfilePlan":            "profile",
+  "ProfileStatus":          "profile",
+  "compile_profile":        "profile",
+  "get_profile_status":     "profile",
+  "ActionQueue":            "actionQueue",
+  "PrivilegedHelper":       "privilegedHelper",
+  "MetricsExporter":        "metricsExporter",
+  "build_sample":           "metricsExporter",
+  "MenuModel":              "menuModel",
+  "MenuRow":                "menuModel",
+  "StatusGraph":            "statusGraph",
+  "RaplReader":             "raplReader",
+  "PowerSampler":           "powerSampler",
+  "StatusReader":           "statusReader",
+  "StatusPublisher":        "statusPublisher",
+  "Sparkline":              "sparkline",
+  "StartupLoader":          "startupLoader",
+}
+
+
+def __getattr__(name: str) -> Any:
+  if name in _exports:
+    value = getattr(importlib.import_module(f".{_exports[name]}", __name__), name)
+  elif name in _submodules:
+    value = importlib.import_module(f".{name}", __name__)
+  else:
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+  globals()[name] = value
+  return value
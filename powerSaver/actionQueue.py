@@ -0,0 +1,96 @@
+# powerSaver - Save power by controlling processes and services
+# Copyright (C) 2021  Nina Alexandra Klama
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import concurrent.futures
+import os
+from typing import Any, Callable, Dict, Hashable, List, Tuple
+
+
+class ActionQueue(object):
+  executor: concurrent.futures.ThreadPoolExecutor
+  actions: Dict[str, Tuple[Hashable, concurrent.futures.Future]]       # key -> (target, future)
+  follow_ups: Dict[str, Tuple[Hashable, Callable, Tuple[Any, ...]]]  # key -> (target, function, args)
+
+  def __init__(self, max_workers: int = 4):
+    self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+    self.actions = {}
+    self.follow_ups = {}
+    # Finished actions write a byte here, so the main loop can poll() for them
+    self.wakeup_read, self.wakeup_write = os.pipe()
+    os.set_blocking(self.wakeup_read, False)
+
+  def fileno(self) -> int:
+    return self.wakeup_read
+
+  def is_pending(self, key: str) -> bool:
+    return key in self.actions
+
+  def submit(self, key: str, target: Hashable, function: Callable, *args) -> None:
+    if key not in self.actions:
+      self.__start(key, target, function, args)
+      return
+    current_target, future = self.actions[key]
+    if current_target == target:
+      # Repeated request, whatever was queued after it is obsolete now
+      self.follow_ups.pop(key, None)
+    elif future.cancel():
+      # Opposite request before the first one even started, they cancel out
+      del self.actions[key]
+      self.follow_ups.pop(key, None)
+    else:
+      # Only the newest request matters once the running one has finished
+      self.follow_ups[key] = (target, function, args)
+
+  def __start(self, key: str, target: Hashable, function: Callable, args: Tuple[Any, ...]) -> None:
+    future = self.executor.submit(function, *args)
+    future.add_done_callback(self.__wakeup)
+    self.actions[key] = (target, future)
+
+  def __wakeup(self, _: concurrent.futures.Future) -> None:
+    try:
+      os.write(self.wakeup_write, b"\0")
+    except OSError:
+      pass
+
+  def poll(self) -> List[Tuple[str, Any]]:
+    try:
+      while len(os.read(self.wakeup_read, 4096)) > 0:
+        pass
+    except BlockingIOError:
+      pass
+    finished = []
+    for key, (target, future) in list(self.actions.items()):
+      if not future.done():
+        continue
+      del self.actions[key]
+      if not future.cancelled():
+        try:
+          finished.append((key, future.result()))
+        except Exception:
+          # Shown as an error, instead of taking the UI and the follow-up down with it
+          finished.append((key, (None, f"Action({key.split('/', 1)[-1]}) ")))
+      if key in self.follow_ups:
+        follow_up_target, function, args = self.follow_ups.pop(key)
+        self.__start(key, follow_up_target, function, args)
+    return finished
+
+  def shutdown(self) -> None:
+    self.follow_ups = {}
+    for target, future in self.actions.values():
+      future.cancel()
+    self.executor.shutdown()
+    os.close(self.wakeup_read)
+    os.close(self.wakeup_write)
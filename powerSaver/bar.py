@@ -0,0 +1,183 @@
+# powerSaver - Save power by controlling processes and services
+# Copyright (C) 2021  Nina Alexandra Klama
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Streams the published status record (see statusPublisher.py) to a status bar:
+#   python -m powerSaver.bar --format i3bar    (i3bar/swaybar protocol)
+#   python -m powerSaver.bar --format waybar   (custom module, return-type json)
+#   python -m powerSaver.bar --format plain    (polybar, tail = true)
+# Only the shared record is read, powerSaver does all the sampling.
+
+import argparse
+import json
+import sys
+import time
+from typing import Any, Callable, Dict, List, Optional, TextIO
+
+from .statusReader import StatusReader
+
+Status = Dict[str, Any]
+
+battery_letters = {
+  "full":        "F",
+  "charging":    "C",
+  "discharging": "D",
+}
+
+highlighted_statuses = ["stopped", "throttled"]  # of process entries
+
+
+def bar_text(status: Optional[Status], stale_after: float) -> str:
+  if status is None or time.time() - status["time"] > stale_after:
+    return "powerSaver: not running"
+  parts = []
+  if "battery" in status:
+    battery = status["battery"]
+    parts.append(f"{battery['percent']:.0f}% {battery_letters.get(battery['status'], 'E')} {battery['watts']:.1f}W")
+  if "cpu_watts" in status:
+    parts.append(f"CPU {status['cpu_watts']:.1f}W")
+  stopped = highlighted_entries(status)
+  if len(stopped) > 0:
+    parts.append(f"{len(stopped)} stopped")
+  return " | ".join(parts)
+
+
+def highlighted_entries(status: Status) -> List[str]:
+  return [key.split("/", 1)[1] for key, entry_status in status["entries"].items()
+          if key.startswith("processes/") and entry_status in highlighted_statuses]
+
+
+def bar_class(status: Optional[Status], stale_after: float) -> str:
+  if status is None or time.time() - status["time"] > stale_after:
+    return "stale"
+  if "battery" in status:
+    return status["battery"]["status"]
+  return "ac"
+
+
+class BarWriter(object):
+  out: TextIO
+  started: bool
+
+  def __init__(self, out: TextIO):
+    self.out = out
+    self.started = False
+
+  def header(self) -> None:
+    pass
+
+  def format(self, status: Optional[Status], stale_after: float) -> str:
+    return bar_text(status, stale_after)
+
+  def write(self, line: str) -> None:
+    self.out.write(line + "\n")
+    self.out.flush()
+
+
+class I3barWriter(BarWriter):
+  def header(self) -> None:
+    self.write(json.dumps({"version": 1}))
+    self.write("[")
+
+  def format(self, status: Optional[Status], stale_after: float) -> str:
+    block = {"name": "powersaver", "full_text": bar_text(status, stale_after)}
+    if bar_class(status, stale_after) == "stale":
+      block["color"] = "#808080"
+    return json.dumps([block])
+
+  def write(self, line: str) -> None:
+    # Every array after the first one is separated by a comma
+    if line.startswith("[{") and self.started:
+      line = "," + line
+    elif line.startswith("[{"):
+      self.started = True
+    super().write(line)
+
+
+class WaybarWriter(BarWriter):
+  def format(self, status: Optional[Status], stale_after: float) -> str:
+    output = {"text": bar_text(status, stale_after), "class": bar_class(status, stale_after)}
+    if status is not None and "battery" in status:
+      output["percentage"] = round(status["battery"]["percent"])
+    if status is not None and len(highlighted_entries(status)) > 0:
+      output["tooltip"] = "\n".join(highlighted_entries(status))
+    return json.dumps(output)
+
+
+writers: Dict[str, Callable[[TextIO], BarWriter]] = {
+  "i3bar":  I3barWriter,
+  "waybar": WaybarWriter,
+  "plain":  BarWriter,
+}
+
+
+def stream(reader: StatusReader, writer: BarWriter, latency: float, poll: float, stale_after: float) -> None:
+  # Checking the sequence number is a read from the mapping, the record itself
+  # is only parsed once per latency budget, and a line only goes out if it differs
+  writer.header()
+  last_sequence = None
+  last_line = None
+  last_format = 0.0
+  pending_since: Optional[float] = time.monotonic() - latency
+  while True:
+    now = time.monotonic()
+    sequence = reader.sequence()
+    if sequence != last_sequence:
+      last_sequence = sequence
+      if pending_since is None:
+        pending_since = now
+    elif pending_since is None and now - last_format > stale_after / 2:
+      # Nothing new for a while, powerSaver might be gone
+      pending_since = now - latency
+    if pending_since is not None and now - pending_since >= latency:
+      pending_since = None
+      last_format = now
+      line = writer.format(reader.read(), stale_after)
+      if line != last_line:
+        writer.write(line)
+        last_line = line
+    time.sleep(poll)
+
+
+def parse_arguments(argv: List[str]) -> argparse.Namespace:
+  parser = argparse.ArgumentParser(prog="powerSaver.bar", description="Stream the powerSaver status to a status bar")
+  parser.add_argument("--format", choices=list(writers.keys()), default="i3bar", help="output protocol")
+  parser.add_argument("--status-file", default=None, help="path of the status record")
+  parser.add_argument("--latency", type=float, default=1.0, help="seconds changes are collected before a line goes out")
+  parser.add_argument("--poll", type=float, default=None,
+                      help="seconds between checks for a new record, the latency by default")
+  parser.add_argument("--stale-after", type=float, default=60.0,
+                      help="seconds without an update until powerSaver counts as gone")
+  arguments = parser.parse_args(argv)
+  # Polling faster than the latency budget only adds wakeups
+  if arguments.poll is None:
+    arguments.poll = arguments.latency
+  return arguments
+
+
+def main(argv: List[str]) -> int:
+  arguments = parse_arguments(argv)
+  reader = StatusReader(arguments.status_file)
+  try:
+    stream(reader, writers[arguments.format](sys.stdout), arguments.latency, arguments.poll, arguments.stale_after)
+  except (KeyboardInterrupt, BrokenPipeError):
+    pass
+  finally:
+    reader.close()
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,175 @@
+# powerSaver - Save power by controlling processes and services
+# Copyright (C) 2021  Nina Alexandra Klama
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import re
+import subprocess
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set
+
+from .privilegedHelper import PrivilegedHelper, PrivilegedHelperError
+from .sysfs import write_attributes
+
+_invalid_group_name_characters = re.compile(r"[^A-Za-z0-9_.-]")
+
+
+def group_name(title: str) -> str:
+  return _invalid_group_name_characters.sub("_", title)
+
+
+class CgroupManager(object):
+  root: Path
+  sudo: bool
+  helper: Optional[PrivilegedHelper]
+  period_us: int
+  members: Dict[str, Set[int]]
+  capped: Set[str]               # Titles this run has set a cpu.max for
+
+  def __init__(self, root: str = "/sys/fs/cgroup/powerSaver", sudo: bool = False, period_us: int = 100000,
+               helper: Optional[PrivilegedHelper] = None):
+    self.root = Path(root)
+    self.sudo = sudo
+    self.helper = helper
+    self.period_us = period_us
+    self.members = {}
+    self.capped = set()
+
+  def group_path(self, title: str) -> Path:
+    return self.root / group_name(title)
+
+  def has_group(self, title: str) -> bool:
+    return self.group_path(title).is_dir()
+
+  def create_group(self, title: str) -> bool:
+    if self.has_group(title):
+      return True
+    if not self.__mkdir(self.root):
+      return False
+    # Child groups can only be capped if the cpu controller is enabled for them
+    if (self.root / "cgroup.subtree_control").exists():
+      self.__write(self.root / "cgroup.subtree_control", "+cpu")
+    return self.__mkdir(self.group_path(title))
+
+  def move_pids(self, title: str, pids: Iterable[int]) -> bool:
+    pids = list(pids)
+    known = self.members.get(title, set())
+    new_pids = [pid for pid in pids if pid not in known]
+    if len(new_pids) > 0:
+      if not self.create_group(title) or not self.__write_pids(self.group_path(title) / "cgroup.procs", new_pids):
+        return False
+    self.members[title] = set(pids)
+    return True
+
+  def freeze(self, title: str) -> bool:
+    return self.__write(self.group_path(title) / "cgroup.freeze", "1")
+
+  def thaw(self, title: str) -> bool:
+    return self.__write(self.group_path(title) / "cgroup.freeze", "0")
+
+  def is_frozen(self, title: str) -> bool:
+    return self.__read(self.group_path(title) / "cgroup.freeze") == "1"
+
+  def set_cpu_max(self, title: str, fraction: Optional[float]) -> bool:
+    if fraction is None:
+      value = f"max {self.period_us}"
+    else:
+      value = f"{max(1000, int(fraction * self.period_us))} {self.period_us}"
+    success = self.__write(self.group_path(title) / "cpu.max", value)
+    if fraction is None:
+      self.capped.discard(title)
+    elif success:
+      self.capped.add(title)
+    return success
+
+  def release_all(self) -> None:
+    # The caps outlive this process otherwise
+    for title in list(self.capped):
+      self.set_cpu_max(title, None)
+
+  def get_cpu_max(self, title: str) -> Optional[float]:
+    value = self.__read(self.group_path(title) / "cpu.max")
+    if value is None:
+      return None
+    quota, *period = value.split()
+    if quota == "max":
+      return None
+    return int(quota) / int(period[0] if len(period) > 0 else self.period_us)
+
+  @staticmethod
+  def __read(path: Path) -> Optional[str]:
+    try:
+      with open(path, 'r') as inF:
+        return inF.readline().strip()
+    except OSError:
+      return None
+
+  def __mkdir(self, path: Path) -> bool:
+    try:
+      path.mkdir(parents=True, exist_ok=True)
+      return True
+    except PermissionError:
+      if not self.sudo:
+        return False
+    except OSError:
+      return False
+    if self.helper is not None:
+      try:
+        return self.helper.mkdir(str(path))
+      except PrivilegedHelperError:
+        pass
+    return subprocess.run(["sudo", "mkdir", "-p", str(path)], capture_output=True).returncode == 0
+
+  def __write(self, path: Path, value: str) -> bool:
+    try:
+      with open(path, 'w') as outF:
+        outF.write(value)
+      return True
+    except PermissionError:
+      if not self.sudo:
+        return False
+    except OSError:
+      return False
+    return write_attributes([path], value, True, self.helper)
+
+  def __write_pids(self, path: Path, pids: List[int]) -> bool:
+    # The kernel only accepts a single pid per write() to cgroup.procs
+    try:
+      fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC)
+    except PermissionError:
+      if not self.sudo:
+        return False
+      if self.helper is not None:
+        try:
+          return self.helper.write([str(path)], " ".join(str(pid) for pid in pids))
+        except PrivilegedHelperError:
+          pass
+      script = 'target="$1"; shift; for pid in "$@"; do echo "$pid" > "$target"; done'
+      command = ["sudo", "sh", "-c", script, "sh", str(path)] + [str(pid) for pid in pids]
+      return subprocess.run(command, capture_output=True).returncode == 0
+    except OSError:
+      return False
+    success = True
+    try:
+      for pid in pids:
+        try:
+          os.write(fd, f"{pid}\n".encode())
+        except ProcessLookupError:
+          pass
+        except OSError:
+          success = False
+    finally:
+      os.close(fd)
+    return success
@@ -0,0 +1,207 @@
+# powerSaver - Save power by controlling processes and services
+# Copyright (C) 2021  Nina Alexandra Klama
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# One-shot commands for scripts and status bars:
+#   python -m powerSaver.cli status [--json]
+#   python -m powerSaver.cli freeze|thaw <process entry>
+#   python -m powerSaver.cli apply <profile>
+
+import argparse
+import json
+import sys
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from .cgroupManager import CgroupManager
+from .config_parser import ConfigParser, ConfigError
+from .processManager import ProcessManager, ProcessStatus, cmdline_filtered_names
+from .profile import ProfileActions, set_process_entry
+
+Entry = Dict[str, Any]
+Sections = Dict[str, List[Entry]]
+
+default_config_file = 'config.yaml'
+
+
+def _scan_processes(config: ConfigParser) -> ProcessManager:
+  process_manager = ProcessManager(config.use_sudo(), scan=False,
+                                   cmdline_names=cmdline_filtered_names(config.processes()))
+  process_manager.update_processes_information()
+  return process_manager
+
+
+def _find_entry(entries: List[Entry], title: str) -> Optional[Entry]:
+  for entry in entries:
+    if entry["title"] == title:
+      return entry
+  for entry in entries:
+    if entry["title"].lower() == title.lower():
+      return entry
+  return None
+
+
+def _cgroup_manager(config: ConfigParser) -> Optional[CgroupManager]:
+  if config.process_backend() == "cgroup":
+    return CgroupManager(config.cgroup_root(), config.use_sudo())
+  return None
+
+
+def create_actions(config: ConfigParser) -> ProfileActions:
+  # Everything status and apply need. The process scan and the cpufreq/device
+  # sysfs walks run in parallel, the other managers are cheap to create.
+  # Imported here, so freeze and thaw do not pay for them.
+  import concurrent.futures
+  from .cpuFreqManager import CpuFreqManager
+  from .devicePowerManager import DevicePowerManager
+  from .moduleManager import ModuleManager
+  from .serviceManager import ServiceManager
+  sudo = config.use_sudo()
+  with concurrent.futures.ThreadPoolExecutor(max_workers=3) as executor:
+    process_future = executor.submit(_scan_processes, config)
+    cpufreq_future = executor.submit(CpuFreqManager, sudo)
+    device_future  = executor.submit(DevicePowerManager, sudo)
+    return ProfileActions(process_future.result(),
+                          ServiceManager(config.init_system(), sudo, config.debug()),
+                          ModuleManager(sudo),
+                          cpufreq_future.result(),
+                          device_future.result(),
+                          _cgroup_manager(config))
+
+
+def collect_status(config: ConfigParser, actions: ProfileActions) -> Sections:
+  import concurrent.futures
+  from .entryStatus import process_entry_status
+  from .profile import get_profile_status
+  from .statusGraph import StatusGraph
+  sections: Sections = {
+    "processes": config.processes(),
+    "services":  config.services(),
+    "modules":   config.modules(),
+    "cpufreq":   config.cpufreq(),
+    "devices":   config.devices(),
+    "profiles":  config.profiles(),
+  }
+  # Service states need a fork each, so they are all queried at once
+  with concurrent.futures.ThreadPoolExecutor(max_workers=8) as executor:
+    status_graph  = StatusGraph(sections["services"], sections["modules"])
+    status_future = executor.submit(status_graph.refresh, actions.service_manager, actions.module_manager, executor)
+    for p in sections["processes"]:
+      p["status"] = process_entry_status(p, actions.process_manager)
+      cgroup_manager = actions.cgroup_manager
+      if p["status"] != ProcessStatus.NO_PROC and cgroup_manager is not None and cgroup_manager.has_group(p["title"]):
+        if cgroup_manager.is_frozen(p["title"]):
+          p["status"] = ProcessStatus.STOPPED
+        elif cgroup_manager.get_cpu_max(p["title"]) is not None:
+          p["status"] = ProcessStatus.THROTTLED
+    for c in sections["cpufreq"]:
+      c["status"] = actions.cpufreq_manager.get_status(c)
+    for d in sections["devices"]:
+      d["status"] = actions.device_manager.get_status(d)
+    status_future.result()
+  for p in sections["profiles"]:
+    p["status"] = get_profile_status(p, sections["processes"], sections["services"], sections["modules"],
+                                     sections["cpufreq"], sections["devices"])
+  return sections
+
+
+def print_status(sample: Dict[str, Any]) -> None:
+  if "battery" in sample:
+    battery = sample["battery"]
+    load = " ".join(f"{watts:.2f}W" for watts in sample["load"])
+    print(f"battery: {battery['status']} {battery['percent']:.1f}% {battery['watts']:.2f}W (load {load})")
+  for key, status in sample["entries"].items():
+    print(f"{key}: {status}")
+
+
+def command_status(config: ConfigParser, arguments: argparse.Namespace) -> int:
+  import concurrent.futures
+  from .metricsExporter import build_sample
+  from .powerStats import PowerStats
+  with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+    power_future   = executor.submit(PowerStats, 5, config.power_sys_class_path())
+    actions_future = executor.submit(create_actions, config)
+    sections = collect_status(config, actions_future.result())
+    sample = build_sample(power_future.result(), sections)
+  if arguments.json:
+    print(json.dumps(sample))
+  else:
+    print_status(sample)
+  return 0
+
+
+def command_freeze(config: ConfigParser, arguments: argparse.Namespace) -> int:
+  entry = _find_entry(config.processes(), arguments.entry)
+  if entry is None:
+    print(f"Unknown process entry: {arguments.entry}", file=sys.stderr)
+    return 2
+  # Only the process scan, nothing else is needed to freeze or thaw an entry
+  if not set_process_entry(_scan_processes(config), _cgroup_manager(config), entry, arguments.command == "freeze"):
+    print(f"Could not {arguments.command} {entry['title']}", file=sys.stderr)
+    return 1
+  return 0
+
+
+def command_apply(config: ConfigParser, arguments: argparse.Namespace) -> int:
+  profile = _find_entry(config.profiles(), arguments.profile)
+  if profile is None:
+    print(f"Unknown profile: {arguments.profile}", file=sys.stderr)
+    return 2
+  from .profile import compile_profile
+  actions = create_actions(config)
+  sections = collect_status(config, actions)
+  plan = compile_profile(profile, sections["processes"], sections["services"], sections["modules"],
+                         sections["cpufreq"], sections["devices"], actions)
+  failed = [key for key, success in plan.run().items() if not success]
+  if len(failed) > 0:
+    print(f"Profile {profile['title']} failed: {', '.join(failed)}", file=sys.stderr)
+    return 1
+  return 0
+
+
+def parse_arguments(argv: List[str]) -> argparse.Namespace:
+  parser = argparse.ArgumentParser(prog="powerSaver", description="Save power by controlling processes and services")
+  parser.add_argument("--config", default=default_config_file, help="path to the configuration file")
+  subparsers = parser.add_subparsers(dest="command", required=True)
+  status_parser = subparsers.add_parser("status", help="print the status of all entries")
+  status_parser.add_argument("--json", action="store_true", help="print a single JSON object")
+  for command in ["freeze", "thaw"]:
+    command_parser = subparsers.add_parser(command, help=f"{command} the processes of an entry")
+    command_parser.add_argument("entry", help="title of the process entry")
+  apply_parser = subparsers.add_parser("apply", help="apply a profile")
+  apply_parser.add_argument("profile", help="title of the profile")
+  return parser.parse_args(argv)
+
+
+commands = {
+  "status": command_status,
+  "freeze": command_freeze,
+  "thaw":   command_freeze,
+  "apply":  command_apply,
+}
+
+
+def main(argv: List[str]) -> int:
+  arguments = parse_arguments(argv)
+  try:
+    config = ConfigParser(Path(arguments.config))
+    return commands[arguments.command](config, arguments)
+  except (ConfigError, OSError) as e:
+    print(f"powerSaver: {e}", file=sys.stderr)
+    return 2
+
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv[1:]))
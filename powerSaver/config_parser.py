@@ -1,6 +1,9 @@
+import json
+import os
 from pathlib import Path
-from typing import Dict, Any, Tuple, List, Union
+from typing import Dict, Any, Tuple, List, Optional, Union
 import powerSaver
+from powerSaver.statusReader import default_status_path
 
 try:
   from yaml import CLoader as Loader
@@ -15,9 +18,11 @@ class ConfigError(Exception):
 
 
 class ConfigParser(object):
+  path: Path
   data: Dict[str, Any]
 
   def __init__(self, config_file_path: Path):
+    self.path = config_file_path
     self.data = yaml.load(config_file_path.open("r"), Loader=Loader)
 
   def debug(self) -> bool:
@@ -29,6 +34,11 @@ class ConfigParser(object):
     if 'use_sudo' in self.data:
       return self.data['use_sudo']
 
+  def privileged_helper(self) -> bool:
+    if 'privileged_helper' in self.data:
+      return bool(self.data['privileged_helper'])
+    return False
+
   def init_system(self) -> str:
     if 'init_system' in self.data:
       return self.data['init_system']
@@ -47,12 +57,74 @@ class ConfigParser(object):
         maximum = int(self.data['refresh']['maximum'])
     return default, power_default, maximum
 
+  def rescan(self) -> int:
+    if 'refresh' in self.data and 'rescan' in self.data['refresh']:
+      return int(self.data['refresh']['rescan'])
+    return 60
+
+  def process_backend(self) -> str:
+    backend = "signal"
+    if 'process_backend' in self.data:
+      backend = self.data['process_backend'].lower()
+    if backend not in ["signal", "cgroup"]:
+      raise ConfigError("process_backend needs to be either 'signal' or 'cgroup'")
+    return backend
+
+  def cgroup_root(self) -> str:
+    if 'cgroup' in self.data and 'root' in self.data['cgroup']:
+      return self.data['cgroup']['root']
+    return "/sys/fs/cgroup/powerSaver"
+
+  def throttle(self, entry: Dict[str, Any] = None) -> Tuple[float, float]:
+    run = 0.2
+    period = 2.0
+    for source in [self.data, entry or {}]:
+      if 'throttle' in source:
+        if 'run' in source['throttle']:
+          run = float(source['throttle']['run'])
+        if 'period' in source['throttle']:
+          period = float(source['throttle']['period'])
+    if run <= 0.0 or period <= run:
+      raise ConfigError("throttle needs 0 < run < period")
+    return run, period
+
+  def export_json(self) -> Optional[str]:
+    if 'export' in self.data and self.data['export'] is not None and 'json' in self.data['export']:
+      return self.data['export']['json']
+    return None
+
+  def export_prometheus(self) -> Optional[str]:
+    if 'export' in self.data and self.data['export'] is not None and 'prometheus' in self.data['export']:
+      return self.data['export']['prometheus']
+    return None
+
+  def export_flush_interval(self) -> float:
+    if 'export' in self.data and self.data['export'] is not None and 'flush_interval' in self.data['export']:
+      return float(self.data['export']['flush_interval'])
+    return 60.0
+
+  def discovery_top(self) -> int:
+    if 'discovery' in self.data and self.data['discovery'] is not None and 'top' in self.data['discovery']:
+      return int(self.data['discovery']['top'])
+    return 10
+
+  def status_file(self) -> Optional[str]:
+    # null turns the shared status record off
+    if 'status_file' in self.data:
+      return self.data['status_file']
+    return default_status_path()
+
   def power_sys_class_path(self) -> str:
     path_str = "/sys/class/power_supply/BAT0"
     if 'power' in self.data and 'sys_class_path' in self.data['power']:
       path_str = self.data['power']['sys_class_path']
     return path_str
 
+  def power_sample_interval(self) -> float:
+    if 'power' in self.data and 'sample_interval' in self.data['power']:
+      return float(self.data['power']['sample_interval'])
+    return 0.5
+
   def battery_colors(self) -> Tuple[int, int, int]:
     b_min = 15.0
     b_med = 60.0
@@ -86,6 +158,43 @@ class ConfigParser(object):
       return self.data['processes']
     return []
 
+  def add_process(self, entry: Dict[str, Any]) -> bool:
+    # Inserted as text at the end of the processes list, so comments and layout of the file stay as they are.
+    # JSON strings are valid YAML and quote any odd characters in the names.
+    lines = [f"  - title: {json.dumps(entry['title'])}", "    name:"]
+    lines += [f"      - {json.dumps(name)}" for name in entry['name']]
+    try:
+      text = self.path.read_text().splitlines()
+    except OSError:
+      return False
+    start = None
+    for n, line in enumerate(text):
+      if line.startswith("processes:"):
+        if line.split("#")[0].strip() != "processes:":
+          return False  # Flow style list
+        start = n
+    if start is None:
+      text += ["", "processes:"]
+      end = len(text)
+    else:
+      end = start + 1
+      while end < len(text) and (text[end].strip() == "" or text[end][0] in " #-"):
+        end += 1
+      while end > start + 1 and text[end - 1].strip() == "":
+        end -= 1
+    text[end:end] = lines
+    temp_path = self.path.with_name(self.path.name + ".tmp")
+    try:
+      temp_path.write_text("\n".join(text) + "\n")
+      os.replace(temp_path, self.path)
+    except OSError:
+      return False
+    if self.data.get('processes') is None:
+      self.data['processes'] = []
+    # A copy, the caller may hold on to the same list as self.data
+    self.data['processes'].append({"title": entry['title'], "name": list(entry['name'])})
+    return True
+
   def services(self) -> List[Dict[str, Union[str, List[str], powerSaver.ServiceStatus]]]:
     if 'services' in self.data:
       return self.data['services']
@@ -95,3 +204,29 @@ class ConfigParser(object):
     if 'modules' in self.data:
       return self.data['modules']
     return []
+
+  def cpufreq(self) -> List[Dict[str, Union[str, int, powerSaver.CpuFreqStatus]]]:
+    if 'cpufreq' in self.data:
+      return self.data['cpufreq']
+    return []
+
+  def devices(self) -> List[Dict[str, Union[str, List[str], powerSaver.DeviceStatus]]]:
+    if 'devices' in self.data:
+      return self.data['devices']
+    return []
+
+  def profiles(self) -> List[Dict[str, Union[str, Dict[str, str], powerSaver.ProfileStatus]]]:
+    if 'profiles' not in self.data or self.data['profiles'] is None:
+      return []
+    targets = {
+      "processes": ["running", "stopped"],
+      "services":  ["started", "stopped"],
+      "modules":   ["loaded", "unloaded"],
+      "devices":   ["on", "auto"],
+    }
+    for profile in self.data['profiles']:
+      for section, allowed in targets.items():
+        for title, target in (profile.get(section) or {}).items():
+          if target not in allowed:
+            raise ConfigError(f"profiles.{profile.get('title')}.{section}.{title} needs to be one of {', '.join(allowed)}")
+    return self.data['profiles']
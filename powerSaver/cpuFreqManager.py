@@ -0,0 +1,123 @@
+# powerSaver - Save power by controlling processes and services
+# Copyright (C) 2021  Nina Alexandra Klama
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from enum import Enum
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from .privilegedHelper import PrivilegedHelper
+from .sysfs import read_attribute, write_attribute_batches
+
+
+class CpuFreqStatus(Enum):
+  ACTIVE      = 0
+  INACTIVE    = 1
+  PARTIAL     = 2
+  UNSUPPORTED = 3
+  ERROR       = 100
+
+
+# Config key -> sysfs attribute, in the order they have to be written
+# (the governor decides which energy preferences are accepted)
+cpufreq_attributes = {
+  "governor": "scaling_governor",
+  "epp":      "energy_performance_preference",
+  "max-freq": "scaling_max_freq",
+}
+
+
+class CpuFreqManager(object):
+  root: Path
+  sudo: bool
+  helper: Optional[PrivilegedHelper]
+  policies: List[Path]
+  max_freq: List[Optional[str]]
+  state: Dict[str, List[Optional[str]]]
+
+  def __init__(self, sudo: bool = True, root: str = "/sys/devices/system/cpu",
+               helper: Optional[PrivilegedHelper] = None):
+    self.root = Path(root)
+    self.sudo = sudo
+    self.helper = helper
+    self.policies = []
+    # CPUs sharing a policy link to the same cpufreq directory
+    seen = set()
+    for cpufreq in sorted(self.root.glob("cpu[0-9]*/cpufreq")):
+      policy = cpufreq.resolve()
+      if policy not in seen:
+        seen.add(policy)
+        self.policies.append(policy)
+    self.max_freq = [read_attribute(policy / "cpuinfo_max_freq") for policy in self.policies]
+    self.update_status()
+
+  def update_status(self) -> None:
+    # Replaced as a whole, get_status() may run in an action at the same time
+    self.state = {key: [read_attribute(policy / attribute) for policy in self.policies]
+                  for key, attribute in cpufreq_attributes.items()}
+
+  def __target_values(self, key: str, target: Dict[str, Any]) -> List[str]:
+    value = str(target[key])
+    if key == "max-freq" and value == "max":
+      return [str(m) for m in self.max_freq]
+    return [value] * len(self.policies)
+
+  def get_status(self, target: Dict[str, Any]) -> CpuFreqStatus:
+    if len(self.policies) == 0:
+      return CpuFreqStatus.UNSUPPORTED
+    state = self.state
+    targets = {key: self.__target_values(key, target) for key in cpufreq_attributes if key in target}
+    matching = 0
+    for i in range(len(self.policies)):
+      policy_matches = True
+      for key, values in targets.items():
+        if state[key][i] is None:
+          return CpuFreqStatus.UNSUPPORTED
+        if state[key][i] != values[i]:
+          policy_matches = False
+      if policy_matches:
+        matching += 1
+    if matching == len(self.policies):
+      return CpuFreqStatus.ACTIVE
+    if matching > 0:
+      return CpuFreqStatus.PARTIAL
+    return CpuFreqStatus.INACTIVE
+
+  def summary(self) -> str:
+    parts = []
+    state = self.state
+    for key in cpufreq_attributes:
+      values = sorted(set(v for v in state[key] if v is not None))
+      if key == "max-freq":
+        values = [f"{int(v) / 1e6:.1f}GHz" for v in values]
+      if len(values) > 0:
+        parts.append("/".join(values))
+    return " ".join(parts)
+
+  def apply(self, target: Dict[str, Any]) -> bool:
+    write_batches = []
+    for key, attribute in cpufreq_attributes.items():
+      if key not in target:
+        continue
+      # Group files by value, so every distinct value is a single write batch
+      batches: Dict[str, List[Path]] = {}
+      for policy, value in zip(self.policies, self.__target_values(key, target)):
+        if value not in batches:
+          batches[value] = []
+        batches[value].append(policy / attribute)
+      write_batches += [(paths, value) for value, paths in batches.items()]
+    success = write_attribute_batches(write_batches, self.sudo, self.helper)
+    self.update_status()
+    return success
@@ -0,0 +1,121 @@
+# powerSaver - Save power by controlling processes and services
+# Copyright (C) 2021  Nina Alexandra Klama
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from enum import Enum
+from fnmatch import fnmatch
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from .privilegedHelper import PrivilegedHelper
+from .sysfs import read_attribute, write_attributes
+
+
+class DeviceStatus(Enum):
+  AUTO      = 0
+  ON        = 1
+  PARTIAL   = 2
+  NOT_FOUND = 3
+  ERROR     = 100
+
+
+class DevicePower(object):
+  bus: str
+  name: str
+  path: Path
+  vendor: Optional[str]
+  control: Optional[str]
+  runtime_status: Optional[str]
+  autosuspend_delay_ms: Optional[int]
+
+  def __init__(self, bus: str, name: str, path: Path):
+    self.bus = bus
+    self.name = name
+    self.path = path
+    vendor = read_attribute(path / ("idVendor" if bus == "usb" else "vendor"))
+    self.vendor = vendor.lower().replace("0x", "") if vendor is not None else None
+    self.control = read_attribute(path / "power" / "control")
+    self.runtime_status = read_attribute(path / "power" / "runtime_status")
+    delay = read_attribute(path / "power" / "autosuspend_delay_ms")
+    self.autosuspend_delay_ms = int(delay) if delay is not None and delay.lstrip("-").isdigit() else None
+
+
+class DevicePowerManager(object):
+  root: Path
+  sudo: bool
+  helper: Optional[PrivilegedHelper]
+  buses: List[str]
+  devices: Dict[str, DevicePower]       # "<bus>/<name>" -> device
+  groups: Dict[str, List[DevicePower]]  # entry title -> devices
+
+  def __init__(self, sudo: bool = True, root: str = "/sys/bus", buses: Tuple[str, ...] = ("usb", "pci"),
+               helper: Optional[PrivilegedHelper] = None):
+    self.root = Path(root)
+    self.sudo = sudo
+    self.helper = helper
+    self.buses = list(buses)
+    self.update_index()
+
+  def update_index(self) -> None:
+    # Actions use the index while it is rebuilt, so the new one replaces the old one only when it is complete
+    devices = {}
+    for bus in self.buses:
+      for path in sorted((self.root / bus / "devices").glob("*")):
+        if (path / "power" / "control").exists():
+          devices[f"{bus}/{path.name}"] = DevicePower(bus, path.name, path)
+    self.devices = devices
+    self.groups = {}
+
+  def get_group(self, entry: Dict[str, Any]) -> List[DevicePower]:
+    groups = self.groups
+    if entry["title"] not in groups:
+      patterns = entry.get("match", ["*"])
+      vendor = str(entry["vendor"]).lower().replace("0x", "") if "vendor" in entry else None
+      groups[entry["title"]] = [device for device in self.devices.values()
+                                if device.bus == entry.get("bus", device.bus)
+                                and any(fnmatch(device.name, pattern) for pattern in patterns)
+                                and (vendor is None or device.vendor == vendor)]
+    return groups[entry["title"]]
+
+  def update_runtime_status(self, entries: List[Dict[str, Any]]) -> None:
+    # Only runtime_status changes on its own, the rest is only changed by us
+    for entry in entries:
+      for device in self.get_group(entry):
+        device.runtime_status = read_attribute(device.path / "power" / "runtime_status")
+
+  def get_status(self, entry: Dict[str, Any]) -> DeviceStatus:
+    group = self.get_group(entry)
+    if len(group) == 0:
+      return DeviceStatus.NOT_FOUND
+    controls = set(device.control for device in group)
+    if None in controls:
+      return DeviceStatus.ERROR
+    if controls == {"auto"}:
+      return DeviceStatus.AUTO
+    if "auto" in controls:
+      return DeviceStatus.PARTIAL
+    return DeviceStatus.ON
+
+  def get_suspended(self, entry: Dict[str, Any]) -> Tuple[int, int]:
+    group = self.get_group(entry)
+    return sum(1 for device in group if device.runtime_status == "suspended"), len(group)
+
+  def set_control(self, entry: Dict[str, Any], auto: bool) -> bool:
+    group = self.get_group(entry)
+    value = "auto" if auto else "on"
+    success = write_attributes([device.path / "power" / "control" for device in group], value, self.sudo, self.helper)
+    for device in group:
+      device.control = read_attribute(device.path / "power" / "control")
+    return success
@@ -0,0 +1,100 @@
+# powerSaver - Save power by controlling processes and services
+# Copyright (C) 2021  Nina Alexandra Klama
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from typing import Callable, Dict, List, Union
+
+from .processManager import ProcessManager, ProcessStatus
+from .serviceManager import ServiceManager, ServiceStatus
+from .moduleManager import ModuleManager, ModuleStatus
+
+
+def service_status_to_module_status(status: ServiceStatus) -> ModuleStatus:
+  if status == ServiceStatus.RUNNING:
+    return ModuleStatus.USED
+  if status == ServiceStatus.STOPPED:
+    return ModuleStatus.NEEDS_CHECK
+  if status == ServiceStatus.TOGGLED:
+    return ModuleStatus.PARTIAL
+  if status == ServiceStatus.NOT_FOUND:
+    return ModuleStatus.NEEDS_CHECK
+  if status == ServiceStatus.CRASHED:
+    return ModuleStatus.NEEDS_CHECK
+  return ModuleStatus.ERROR
+
+
+def process_entry_status(p: Dict[str, Union[str, List[str], ProcessStatus]],
+                         process_manager: ProcessManager) -> ProcessStatus:
+  p_status = set()
+  for proc in p["name"]:
+    if "cmdline" in p:
+      proc_status = process_manager.get_process_status(proc, p["cmdline"])
+    else:
+      proc_status = process_manager.get_process_status(proc)
+    for p_s in proc_status:
+      p_status.add(p_s)
+  if ProcessStatus.ERROR in p_status:
+    return ProcessStatus.ERROR
+  elif len(p_status) == 0:
+    return ProcessStatus.NO_PROC
+  elif len(p_status) > 1:
+    return ProcessStatus.MANY
+  return p_status.pop()
+
+
+def derive_service_status(s: Dict[str, Union[str, List[str], ServiceStatus]],
+                          service_status: Callable[[str], ServiceStatus],
+                          module_status:  Callable[[str], ModuleStatus]) -> ServiceStatus:
+  status = service_status(s["name"])
+  if "needs-modules" in s:
+    for mod in s["needs-modules"]:
+      if module_status(mod) not in [ModuleStatus.LOADED,
+                                    ModuleStatus.USED]:
+        status = ServiceStatus.NO_MODULES
+  return status
+
+
+def derive_module_status(m: Dict[str, Union[str, List[str], ModuleStatus]],
+                         service_status: Callable[[str], ServiceStatus],
+                         module_status:  Callable[[str], ModuleStatus]) -> ModuleStatus:
+  status = []
+  if "usage-modules" in m and "service" not in m:
+    for mod in m["usage-modules"]:
+      status.append(module_status(mod))
+  elif "service" in m:
+    status.append(service_status_to_module_status(service_status(m['service'])))
+    if status[0] == ModuleStatus.NEEDS_CHECK:
+      status.clear()
+      for mod in m["usage-modules"]:
+        status.append(module_status(mod))
+  if ModuleStatus.LOADED in status or ModuleStatus.USED in status:
+    if ModuleStatus.NOT_LOADED in status:
+      return ModuleStatus.PARTIAL
+    if ModuleStatus.USED in status:
+      return ModuleStatus.USED
+    return ModuleStatus.LOADED
+  return ModuleStatus.NOT_LOADED
+
+
+def service_entry_status(s: Dict[str, Union[str, List[str], ServiceStatus]],
+                         service_manager: ServiceManager,
+                         module_manager:  ModuleManager) -> ServiceStatus:
+  return derive_service_status(s, service_manager.get_status, module_manager.get_module_status)
+
+
+def module_entry_status(m: Dict[str, Union[str, List[str], ModuleStatus]],
+                        service_manager: ServiceManager,
+                        module_manager:  ModuleManager) -> ModuleStatus:
+  return derive_module_status(m, service_manager.get_status, module_manager.get_module_status)
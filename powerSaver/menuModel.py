@@ -0,0 +1,173 @@
+# powerSaver - Save power by controlling processes and services
+# Copyright (C) 2021  Nina Alexandra Klama
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+Entry = Dict[str, Any]
+
+
+class MenuRow(object):
+  section: str              # Section of the entry, or of the block a divider introduces
+  entry: Optional[Entry]    # None for dividers
+  selectable: bool
+
+  def __init__(self, section: str, entry: Optional[Entry] = None, selectable: bool = False):
+    self.section = section
+    self.entry = entry
+    self.selectable = selectable
+
+  def is_divider(self) -> bool:
+    return self.entry is None
+
+  def key(self) -> Optional[str]:
+    if self.entry is None:
+      return None
+    return f"{self.section}/{self.entry['title']}"
+
+
+class MenuModel(object):
+  layout: List[MenuRow]            # All rows, as they are shown without a filter
+  entry_rows: List[int]            # Indices into layout of all entry rows
+  index: List[str]                 # Lower case titles, aligned with entry_rows
+  filter_text: str
+  filter_stack: List[List[int]]    # Matches (indices into entry_rows) for every prefix of filter_text
+  rows: List[MenuRow]              # Rows currently shown
+  selectable: List[int]            # Indices into rows, in order
+  cursor: int                      # Index into selectable
+  top: int                         # First row inside the viewport
+  height: int                      # Rows inside the viewport
+
+  def __init__(self, height: int = 1):
+    self.layout = []
+    self.entry_rows = []
+    self.index = []
+    self.filter_text = ""
+    self.filter_stack = []
+    self.rows = []
+    self.selectable = []
+    self.cursor = 0
+    self.top = 0
+    self.height = max(1, height)
+
+  def rebuild(self,
+              sections: List[Tuple[str, List[Entry]]],
+              visible: Callable[[str, Entry], bool],
+              selectable: Callable[[str, Entry], bool],
+              dividers: Dict[str, Tuple[bool, bool]]) -> None:
+    # dividers: section -> (divider before the block, divider after the block),
+    # only drawn if the block has any visible rows
+    self.layout = []
+    for section, entries in sections:
+      block = [MenuRow(section, entry, selectable(section, entry)) for entry in entries if visible(section, entry)]
+      if len(block) == 0:
+        continue
+      before, after = dividers.get(section, (False, False))
+      if before:
+        self.layout.append(MenuRow(section))
+      self.layout += block
+      if after:
+        self.layout.append(MenuRow(section))
+    self.entry_rows = [i for i, row in enumerate(self.layout) if not row.is_divider()]
+    self.index = [self.layout[i].entry["title"].lower() for i in self.entry_rows]
+    # The entries changed, so the filter has to start over
+    filter_text = self.filter_text
+    self.filter_text = ""
+    self.filter_stack = []
+    self.set_filter(filter_text)
+
+  def set_filter(self, text: str) -> None:
+    text = text.lower()
+    common = 0
+    while common < min(len(text), len(self.filter_text)) and text[common] == self.filter_text[common]:
+      common += 1
+    # A longer needle can only match a subset of what its prefix matched,
+    # so every keystroke only looks at the previous matches
+    del self.filter_stack[common:]
+    matches = self.filter_stack[-1] if len(self.filter_stack) > 0 else list(range(len(self.index)))
+    for length in range(common + 1, len(text) + 1):
+      needle = text[:length]
+      matches = [m for m in matches if needle in self.index[m]]
+      self.filter_stack.append(matches)
+    self.filter_text = text
+    self.__update_rows()
+
+  def __update_rows(self) -> None:
+    selected = self.selected()
+    selected_key = selected.key() if selected is not None else None
+    if len(self.filter_text) == 0:
+      self.rows = self.layout
+    else:
+      self.rows = [self.layout[self.entry_rows[m]] for m in self.filter_stack[-1]]
+    self.selectable = [i for i, row in enumerate(self.rows) if row.selectable]
+    # Keep the cursor on the same entry if it is still there
+    self.cursor = min(self.cursor, max(0, len(self.selectable) - 1))
+    if selected_key is not None:
+      for n, i in enumerate(self.selectable):
+        if self.rows[i].key() == selected_key:
+          self.cursor = n
+          break
+    self.scroll_to_cursor()
+
+  def set_height(self, height: int) -> None:
+    self.height = max(1, height)
+    self.scroll_to_cursor()
+
+  def selected_row_index(self) -> Optional[int]:
+    if len(self.selectable) == 0:
+      return None
+    return self.selectable[self.cursor]
+
+  def selected(self) -> Optional[MenuRow]:
+    index = self.selected_row_index()
+    if index is None:
+      return None
+    return self.rows[index]
+
+  def move(self, delta: int) -> None:
+    if len(self.selectable) == 0:
+      return
+    self.cursor = min(len(self.selectable) - 1, max(0, self.cursor + delta))
+    self.scroll_to_cursor()
+
+  def page(self, direction: int) -> None:
+    # Moves by a viewport worth of rows, not of selectable entries
+    index = self.selected_row_index()
+    if index is None:
+      return
+    target = index + direction * self.height
+    if direction > 0:
+      candidates = [n for n, i in enumerate(self.selectable) if i <= target]
+      self.cursor = candidates[-1] if len(candidates) > 0 else 0
+    else:
+      candidates = [n for n, i in enumerate(self.selectable) if i >= target]
+      self.cursor = candidates[0] if len(candidates) > 0 else len(self.selectable) - 1
+    self.scroll_to_cursor()
+
+  def scroll_to_cursor(self) -> None:
+    index = self.selected_row_index()
+    if index is not None:
+      if index < self.top:
+        self.top = index
+      elif index >= self.top + self.height:
+        self.top = index - self.height + 1
+    self.top = max(0, min(self.top, len(self.rows) - self.height))
+
+  def visible_rows(self) -> List[Tuple[int, MenuRow]]:
+    # (position inside the viewport, row)
+    return list(enumerate(self.rows[self.top:self.top + self.height]))
+
+  def is_selected(self, row: MenuRow) -> bool:
+    return row is self.selected()
@@ -0,0 +1,147 @@
+# powerSaver - Save power by controlling processes and services
+# Copyright (C) 2021  Nina Alexandra Klama
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import json
+import os
+import time
+from enum import Enum
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from .powerStats import PowerStats
+from .raplReader import RaplReader
+
+Sample = Dict[str, Any]
+
+load_windows = ["1m", "5m", "15m"]
+
+
+def build_sample(power_stats: PowerStats, sections: Dict[str, List[Dict[str, Any]]],
+                 rapl: Optional[RaplReader] = None, battery_watts: Optional[float] = None) -> Sample:
+  # battery_watts replaces the draw of the last PowerStats refresh, e.g. with a PowerSampler average
+  sample: Sample = {"time": round(time.time(), 3)}
+  if power_stats.working:
+    battery_status, battery_percent, refreshed_watts, _, _ = power_stats.get_current_stats()
+    if battery_watts is None:
+      battery_watts = refreshed_watts
+    sample["battery"] = {
+      "status":  battery_status.name.lower(),
+      "percent": round(battery_percent, 2),
+      "watts":   round(battery_watts, 3),
+    }
+    sample["load"] = [round(load, 3) for load in power_stats.get_power_load()]
+  if rapl is not None and len(rapl.get_watts()) > 0:
+    sample["rapl"] = {domain: round(watts, 3) for domain, watts in rapl.get_watts().items()}
+  sample["entries"] = {}
+  for section, entries in sections.items():
+    for entry in entries:
+      if isinstance(entry.get("status"), Enum):
+        sample["entries"][f"{section}/{entry['title']}"] = entry["status"].name.lower()
+  return sample
+
+
+def _escape_label(value: str) -> str:
+  return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def prometheus_text(sample: Sample) -> str:
+  lines = []
+  if "battery" in sample:
+    battery = sample["battery"]
+    lines += ["# HELP powersaver_battery_watts Current battery power draw",
+              "# TYPE powersaver_battery_watts gauge",
+              f"powersaver_battery_watts {battery['watts']}",
+              "# HELP powersaver_battery_percent Battery charge",
+              "# TYPE powersaver_battery_percent gauge",
+              f"powersaver_battery_percent {battery['percent']}",
+              "# HELP powersaver_battery_status Battery status",
+              "# TYPE powersaver_battery_status gauge",
+              f"powersaver_battery_status{{status=\"{battery['status']}\"}} 1",
+              "# HELP powersaver_power_load_watts Moving average of the power draw",
+              "# TYPE powersaver_power_load_watts gauge"]
+    for window, load in zip(load_windows, sample["load"]):
+      lines.append(f"powersaver_power_load_watts{{window=\"{window}\"}} {load}")
+  if "rapl" in sample:
+    lines += ["# HELP powersaver_rapl_watts Power draw of the RAPL domains",
+              "# TYPE powersaver_rapl_watts gauge"]
+    for domain, watts in sample["rapl"].items():
+      lines.append(f"powersaver_rapl_watts{{domain=\"{_escape_label(domain)}\"}} {watts}")
+  lines += ["# HELP powersaver_entry_status Status of the configured entries",
+            "# TYPE powersaver_entry_status gauge"]
+  for key, status in sample["entries"].items():
+    section, title = key.split("/", 1)
+    lines.append(f"powersaver_entry_status{{section=\"{_escape_label(section)}\","
+                 f"title=\"{_escape_label(title)}\",status=\"{status}\"}} 1")
+  return "\n".join(lines) + "\n"
+
+
+class MetricsExporter(object):
+  json_path: Optional[Path]
+  prometheus_path: Optional[Path]
+  flush_interval: float
+  buffer: List[str]
+  latest: Optional[Sample]
+  last_flush: float
+
+  def __init__(self, json_path: Optional[str] = None, prometheus_path: Optional[str] = None,
+               flush_interval: float = 60.0):
+    self.json_path = Path(json_path).expanduser() if json_path else None
+    self.prometheus_path = Path(prometheus_path).expanduser() if prometheus_path else None
+    self.flush_interval = flush_interval
+    self.buffer = []
+    self.latest = None
+    self.last_flush = time.monotonic()
+
+  def enabled(self) -> bool:
+    return self.json_path is not None or self.prometheus_path is not None
+
+  def record(self, sample: Sample) -> None:
+    # Samples are only written out together, on a sample that is due anyway,
+    # so exporting never needs a wakeup of its own
+    if not self.enabled():
+      return
+    if self.json_path is not None:
+      self.buffer.append(json.dumps(sample, separators=(",", ":")))
+    self.latest = sample
+    if time.monotonic() - self.last_flush >= self.flush_interval:
+      self.flush()
+
+  def flush(self) -> bool:
+    self.last_flush = time.monotonic()
+    success = True
+    if self.json_path is not None and len(self.buffer) > 0:
+      # Dropped on a failed write as well: kept, the buffer would grow without bound,
+      # and a retry after a partial write would repeat the lines that made it
+      lines, self.buffer = self.buffer, []
+      try:
+        self.json_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.json_path, 'a') as outF:
+          outF.write("\n".join(lines) + "\n")
+      except OSError:
+        success = False
+    if self.prometheus_path is not None and self.latest is not None:
+      # node_exporter must never see a half written file
+      temp_path = self.prometheus_path.with_name(self.prometheus_path.name + ".tmp")
+      try:
+        with open(temp_path, 'w') as outF:
+          outF.write(prometheus_text(self.latest))
+        os.replace(temp_path, self.prometheus_path)
+      except OSError:
+        success = False
+    return success
+
+  def close(self) -> None:
+    self.flush()
@@ -16,7 +16,10 @@
 
 import subprocess
 from enum import Enum
-from typing import Dict, List
+from typing import Dict, List, Optional
+
+from .privilegedHelper import PrivilegedHelper, run_command
+from .snapshot import capture
 
 
 class ModuleStatus(Enum):
@@ -31,17 +34,41 @@ class ModuleStatus(Enum):
 class ModuleManager(object):
   modules: Dict[str, int]
   sudo: bool
+  helper: Optional[PrivilegedHelper]
 
-  def __init__(self, sudo: bool = True):
+  def __init__(self, sudo: bool = True, helper: Optional[PrivilegedHelper] = None):
     self.sudo = sudo
+    self.helper = helper
     self.update_modules_list()
 
+  def __getstate__(self):
+    state = self.__dict__.copy()
+    state["helper"] = None
+    return state
+
+  @staticmethod
+  def __read_proc_modules() -> Optional[List[str]]:
+    try:
+      with open('/proc/modules', 'r') as inF:
+        return inF.readlines()
+    except OSError:
+      return None
+
+  @staticmethod
+  def __run_lsmod() -> Optional[str]:
+    try:
+      return subprocess.run(['lsmod'], capture_output=True).stdout.decode()
+    except OSError:
+      return None
+
   def update_modules_list(self):
-    lsmod_result = subprocess.run(['lsmod'], capture_output=True)
-    lsmod_output = lsmod_result.stdout.decode()
-    lsmod_lines  = lsmod_output.splitlines()[1:]
+    # /proc/modules has the same columns as lsmod, without the fork
+    module_lines = capture("modules", "/proc/modules", self.__read_proc_modules)
+    if module_lines is None:
+      lsmod_output = capture("modules", "lsmod", self.__run_lsmod)
+      module_lines = lsmod_output.splitlines()[1:] if lsmod_output is not None else []
     self.modules = {}
-    for line in lsmod_lines:
+    for line in module_lines:
       name, size, used, *rest = line.split()
       self.modules[name] = int(used)
 
@@ -52,25 +79,14 @@ class ModuleManager(object):
       return ModuleStatus.USED
     return ModuleStatus.LOADED
 
-  @staticmethod
-  def __generate_command(command: str, name: str, sudo: bool) -> List[str]:
-    output = []
-    if sudo:
-      output.append('sudo')
-    output.append(command)
-    output.append(name)
-    return output
-
   def load_module(self, name: str) -> bool:
-    modprobe_result = subprocess.run(self.__generate_command('modprobe', name, self.sudo),
-                                     capture_output=True)
+    modprobe_result = run_command(['modprobe', name], self.sudo, self.helper)
     if modprobe_result.returncode == 0:
       return True
     return False
 
   def unload_module(self, name: str) -> bool:
-    rmmod_result = subprocess.run(self.__generate_command('rmmod', name, self.sudo),
-                                  capture_output=True)
+    rmmod_result = run_command(['rmmod', name], self.sudo, self.helper)
     if rmmod_result.returncode == 0:
       return True
     return False
@@ -0,0 +1,132 @@
+# powerSaver - Save power by controlling processes and services
+# Copyright (C) 2021  Nina Alexandra Klama
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import math
+import threading
+import time
+from array import array
+from pathlib import Path
+from typing import Optional, Tuple
+
+from .raplReader import RaplReader
+from .sysfs import read_attribute
+
+
+def read_battery_watts(battery_path: Path) -> Optional[float]:
+  # Not every battery has power_now, voltage times current is the same figure
+  power = read_attribute(battery_path / "power_now")
+  if power is not None and power.lstrip("-").isdigit():
+    return abs(int(power)) / 1e6
+  voltage = read_attribute(battery_path / "voltage_now")
+  current = read_attribute(battery_path / "current_now")
+  if voltage is None or current is None or not voltage.isdigit() or not current.lstrip("-").isdigit():
+    return None
+  return int(voltage) * abs(int(current)) / 1e12
+
+
+class PowerSampler(object):
+  # One thread writes samples into preallocated ring buffers, readers only look
+  # at the buffers. A slot is written before the sample count moves past it, so
+  # readers never need a lock, as long as they look back less than a full ring.
+  battery_path: Path
+  rapl: RaplReader
+  interval: float
+  idle_timeout: float
+  size: int
+  times: array         # 'd', CLOCK_MONOTONIC
+  battery_watts: array  # 'd', NaN without a reading
+  rapl_watts: array     # 'd', NaN without a reading
+  written: int
+  last_read: float
+  paused: bool
+  running: bool
+  wakeup: threading.Event
+  thread: Optional[threading.Thread]
+
+  def __init__(self, battery_path: str, rapl: RaplReader, interval: float = 0.5,
+               history: float = 300.0, idle_timeout: float = 30.0):
+    self.battery_path = Path(battery_path)
+    self.rapl = rapl
+    self.interval = max(0.05, interval)
+    self.idle_timeout = idle_timeout
+    self.size = max(2, math.ceil(history / self.interval))
+    self.times = array('d', [0.0] * self.size)
+    self.battery_watts = array('d', [math.nan] * self.size)
+    self.rapl_watts = array('d', [math.nan] * self.size)
+    self.written = 0
+    self.last_read = time.monotonic()
+    self.paused = False
+    self.running = False
+    self.wakeup = threading.Event()
+    self.thread = None
+
+  def start(self) -> None:
+    self.running = True
+    self.thread = threading.Thread(target=self.__run, name="powerSampler", daemon=True)
+    self.thread.start()
+
+  def stop(self) -> None:
+    self.running = False
+    self.wakeup.set()
+    if self.thread is not None:
+      self.thread.join()
+      self.thread = None
+
+  def __run(self) -> None:
+    while self.running:
+      if time.monotonic() - self.last_read > self.idle_timeout:
+        # Nobody looked for a while, sleep until somebody does
+        self.paused = True
+        self.wakeup.wait()
+        self.wakeup.clear()
+        self.paused = False
+        continue
+      self.__sample()
+      self.wakeup.wait(self.interval)
+      self.wakeup.clear()
+
+  def __sample(self) -> None:
+    self.rapl.update()
+    battery_watts = read_battery_watts(self.battery_path)
+    rapl_watts = self.rapl.package_watts()
+    slot = self.written % self.size
+    self.times[slot] = time.monotonic()
+    self.battery_watts[slot] = battery_watts if battery_watts is not None else math.nan
+    self.rapl_watts[slot] = rapl_watts if rapl_watts is not None else math.nan
+    self.written += 1
+
+  def __touch(self) -> None:
+    self.last_read = time.monotonic()
+    if self.paused:
+      self.wakeup.set()
+
+  def average(self, seconds: float) -> Tuple[Optional[float], Optional[float]]:
+    # Mean (battery, RAPL package) watts of the samples from the last seconds
+    self.__touch()
+    written = self.written
+    since = time.monotonic() - seconds
+    battery = []
+    rapl = []
+    for n in range(written - 1, max(-1, written - self.size), -1):
+      slot = n % self.size
+      if self.times[slot] < since:
+        break
+      if not math.isnan(self.battery_watts[slot]):
+        battery.append(self.battery_watts[slot])
+      if not math.isnan(self.rapl_watts[slot]):
+        rapl.append(self.rapl_watts[slot])
+    return (sum(battery) / len(battery) if len(battery) > 0 else None,
+            sum(rapl) / len(rapl) if len(rapl) > 0 else None)
@@ -15,14 +15,27 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import math
+import time
+from collections import deque
 from time import sleep
-from datetime import datetime
 from enum import Enum
 from pathlib import Path
-from typing import List, Tuple, Optional
+from typing import Deque, Tuple, Optional
 
 import funcy as funcy
 
+from .snapshot import capture
+
+# CLOCK_BOOTTIME keeps counting during suspend, CLOCK_MONOTONIC does not
+_clock_boottime = getattr(time, "CLOCK_BOOTTIME", time.CLOCK_MONOTONIC)
+
+load_time_constants = (60.0, 300.0, 900.0)  # 1, 5 and 15 minutes
+suspend_threshold   = 1.0                   # seconds missing from CLOCK_MONOTONIC
+
+
+def clock_boottime() -> float:
+  return time.clock_gettime(_clock_boottime)
+
 
 class BatteryStatus(Enum):
   FULL        = " "
@@ -36,31 +49,30 @@ class PowerStats(object):
 
   power_load: Tuple[float, float, float]
   refresh: int
-  last_refresh: Optional[datetime] = None
+  last_refresh: Optional[float] = None            # CLOCK_BOOTTIME
+  last_refresh_monotonic: Optional[float] = None
   battery_status: BatteryStatus
   charge_full: float
   charge_design: float
   charge_now:  float = 0.0
   voltage_now: float = 0.0
   current_now: float = 0.0
+  history: Deque[float]     # Watts of the last refreshes, oldest first
+  history_total: int        # Refreshes ever added to the history
   working: bool
 
-  load_constants: List[List[float]]  # load_constants[delta_t-1][x] x=0 => 1, x=1 => 5, x=2 => 15
-  load_constants_max: int
-
-  def __init__(self, refresh: int = 5, battery_path: str = "/sys/class/power_supply/BAT0"):
-    self.load_constants = []
-    self.__calc_loadconstants(60)
+  def __init__(self, refresh: int = 5, battery_path: str = "/sys/class/power_supply/BAT0",
+               history_length: int = 240):
     self.working = True
     self.battery_path = Path(battery_path)
     self.refresh = refresh
     self.power_load = (0.0, 0.0, 0.0)
-    if self.battery_path.is_dir():
+    self.history = deque(maxlen=history_length)
+    self.history_total = 0
+    if capture("exists", str(self.battery_path), self.battery_path.is_dir, False):
       self.refresh_status()
-      with open(self.battery_path / "charge_full", 'r') as inF:
-        self.charge_full = int(inF.readline().strip()) / 1e6
-      with open(self.battery_path / "charge_full_design", 'r') as inF:
-        self.charge_design = int(inF.readline().strip()) / 1e6
+      self.charge_full = int(self.__read_value("charge_full")) / 1e6
+      self.charge_design = int(self.__read_value("charge_full_design")) / 1e6
     else:
       self.working = False
 
@@ -69,53 +81,62 @@ class PowerStats(object):
     p, l, c = in_data
     return (1.0 - c) * p + c * l
 
-  def __calc_loadconstants(self, maximum: int) -> None:
-    delta = maximum - len(self.load_constants)
-    self.load_constants_max = maximum
-    time_sec = [60.0, 300.0, 900.0]
-    for delta_t in range(len(self.load_constants), maximum):
-      time_const = funcy.lmap(lambda x: math.exp(-(delta_t + 1) / x), time_sec)
-      self.load_constants.append(time_const)
+  @staticmethod
+  def decay_factors(elapsed: float) -> Tuple[float, float, float]:
+    return tuple(math.exp(-elapsed / time_constant) for time_constant in load_time_constants)
+
+  def __read_value(self, name: str) -> str:
+    path = self.battery_path / name
+
+    def read() -> str:
+      with open(path, 'r') as inF:
+        return inF.readline().strip()
+    return capture("sysfs", str(path), read, "")
 
   def refresh_status(self):
-    with open(self.battery_path / "status", 'r') as inF:
-      battery_status = inF.readline().strip()
-      if battery_status == "Full":
-        self.battery_status = BatteryStatus.FULL
-      elif battery_status == "Discharging":
-        self.battery_status = BatteryStatus.DISCHARGING
-      elif battery_status == "Charging":
-        self.battery_status = BatteryStatus.CHARGING
-      else:
-        self.battery_status = BatteryStatus.ERROR
-    with open(self.battery_path / "charge_now", 'r') as inF:
-      self.charge_now = float(inF.readline().strip()) / 1.0e6
+    battery_status = self.__read_value("status")
+    if battery_status == "Full":
+      self.battery_status = BatteryStatus.FULL
+    elif battery_status == "Discharging":
+      self.battery_status = BatteryStatus.DISCHARGING
+    elif battery_status == "Charging":
+      self.battery_status = BatteryStatus.CHARGING
+    else:
+      self.battery_status = BatteryStatus.ERROR
+    self.charge_now = float(self.__read_value("charge_now")) / 1.0e6
     if self.battery_status in [BatteryStatus.CHARGING, BatteryStatus.DISCHARGING]:
-      with open(self.battery_path / "voltage_now", 'r') as inF:
-        self.voltage_now = float(inF.readline().strip()) / 1.0e6
-      with open(self.battery_path / "current_now", 'r') as inF:
-        self.current_now = float(inF.readline().strip()) / 1.0e6
+      self.voltage_now = float(self.__read_value("voltage_now")) / 1.0e6
+      self.current_now = float(self.__read_value("current_now")) / 1.0e6
 
     power = self.voltage_now * self.current_now
+    if self.battery_status in [BatteryStatus.CHARGING, BatteryStatus.DISCHARGING]:
+      self.history.append(power)
+    else:
+      self.history.append(0.0)  # voltage and current are not read then
+    self.history_total += 1
 
     if self.battery_status == BatteryStatus.DISCHARGING:
+      now_boottime  = capture("clock", "boottime", clock_boottime)
+      now_monotonic = capture("clock", "monotonic", time.monotonic)
       if self.last_refresh is None:
         self.power_load = (power, power, power)
-        time_since_refresh = self.refresh
       else:
-        time_since_refresh = int(round((datetime.now() - self.last_refresh).total_seconds()))
-
-      if time_since_refresh > self.load_constants_max:
-        self.__calc_loadconstants(time_since_refresh*2)
-      self.last_refresh = datetime.now()
-
-      self.power_load = tuple(funcy.map(self.calc_moving_average,
-                                        zip((power, power, power),
-                                            self.power_load,
-                                            self.load_constants[time_since_refresh-1])))
+        elapsed   = max(0.0, now_boottime - self.last_refresh)
+        suspended = elapsed - (now_monotonic - self.last_refresh_monotonic)
+        if suspended > suspend_threshold:
+          # The loads from before the suspend say nothing about the power draw now
+          self.power_load = (power, power, power)
+        else:
+          self.power_load = tuple(funcy.map(self.calc_moving_average,
+                                            zip((power, power, power),
+                                                self.power_load,
+                                                self.decay_factors(elapsed))))
+      self.last_refresh = now_boottime
+      self.last_refresh_monotonic = now_monotonic
     else:
       self.power_load = (0.0, 0.0, 0.0)
       self.last_refresh = None
+      self.last_refresh_monotonic = None
 
   def get_power_load(self) -> Tuple[float, float, float]:
     if self.battery_status == BatteryStatus.CHARGING:
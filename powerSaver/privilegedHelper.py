@@ -0,0 +1,219 @@
+# powerSaver - Save power by controlling processes and services
+# Copyright (C) 2021  Nina Alexandra Klama
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# This file is also executed on its own as root (sudo python3 privilegedHelper.py),
+# so it must only depend on the standard library.
+
+import json
+import os
+import re
+import signal
+import subprocess
+import sys
+import threading
+from typing import Any, Dict, IO, List, Optional, Tuple
+
+# No leading "-", the commands run as root and must not get any options
+_valid_argument = re.compile(r"^[A-Za-z0-9_.@:+][A-Za-z0-9_.@:+-]*$")
+_valid_value = re.compile(r"^[A-Za-z0-9_ +-]*$")
+
+allowed_signals = {"SIGSTOP": signal.SIGSTOP, "SIGCONT": signal.SIGCONT}
+allowed_commands = {
+  "modprobe": 1,
+  "rmmod": 1,
+  "/sbin/rc-service": 2,
+}
+allowed_service_actions = ["start", "stop", "status", "zap"]
+allowed_write_prefixes = ["/sys/devices/", "/sys/fs/cgroup/"]
+allowed_write_attributes = [
+  "scaling_governor", "energy_performance_preference", "scaling_max_freq",
+  "control",
+  "cgroup.freeze", "cgroup.procs", "cgroup.subtree_control", "cpu.max",
+]
+allowed_mkdir_prefixes = ["/sys/fs/cgroup/"]
+
+
+class PrivilegedHelperError(Exception):
+  pass
+
+
+def _result(returncode: int, stdout: str = "", stderr: str = "") -> Dict[str, Any]:
+  return {"returncode": returncode, "stdout": stdout, "stderr": stderr}
+
+
+def _allowed_path(path: str, prefixes: List[str]) -> Optional[str]:
+  real_path = os.path.realpath(path)
+  for prefix in prefixes:
+    if real_path.startswith(prefix):
+      return real_path
+  return None
+
+
+def _signal(action: Dict[str, Any]) -> Dict[str, Any]:
+  if action.get("signal") not in allowed_signals:
+    return _result(1, stderr="signal not allowed")
+  returncode = 0
+  for pid in action.get("pids", []):
+    if not isinstance(pid, int) or pid <= 1:
+      return _result(1, stderr="invalid pid")
+    try:
+      os.kill(pid, allowed_signals[action["signal"]])
+    except OSError:
+      returncode = 1
+  return _result(returncode)
+
+
+def _exec(action: Dict[str, Any]) -> Dict[str, Any]:
+  argv = action.get("argv", [])
+  if len(argv) == 0 or argv[0] not in allowed_commands or len(argv) != allowed_commands[argv[0]] + 1:
+    return _result(1, stderr="command not allowed")
+  if not all(isinstance(arg, str) and _valid_argument.match(arg) for arg in argv[1:]):
+    return _result(1, stderr="invalid argument")
+  if argv[0] == "/sbin/rc-service" and argv[2] not in allowed_service_actions:
+    return _result(1, stderr="service action not allowed")
+  run_result = subprocess.run(argv, capture_output=True)
+  return _result(run_result.returncode, run_result.stdout.decode(), run_result.stderr.decode())
+
+
+def _write(action: Dict[str, Any]) -> Dict[str, Any]:
+  value = action.get("value", "")
+  if not isinstance(value, str) or not _valid_value.match(value):
+    return _result(1, stderr="invalid value")
+  returncode = 0
+  for path in action.get("paths", []):
+    real_path = _allowed_path(path, allowed_write_prefixes)
+    if real_path is None or os.path.basename(real_path) not in allowed_write_attributes:
+      return _result(1, stderr="path not allowed")
+    # cgroup.procs only takes a single pid per write()
+    values = value.split() if os.path.basename(real_path) == "cgroup.procs" else [value]
+    try:
+      fd = os.open(real_path, os.O_WRONLY)
+    except OSError:
+      returncode = 1
+      continue
+    try:
+      for v in values:
+        try:
+          os.write(fd, v.encode())
+        except ProcessLookupError:
+          pass  # Process exited before it could be moved
+        except OSError:
+          returncode = 1
+    finally:
+      os.close(fd)
+  return _result(returncode)
+
+
+def _mkdir(action: Dict[str, Any]) -> Dict[str, Any]:
+  path = action.get("path", "")
+  real_path = _allowed_path(path, allowed_mkdir_prefixes) if isinstance(path, str) else None
+  if real_path is None:
+    return _result(1, stderr="path not allowed")
+  try:
+    # The checked path, a symlink swapped in after the check is not followed again
+    os.makedirs(real_path, exist_ok=True)
+  except OSError as e:
+    return _result(1, stderr=str(e))
+  return _result(0)
+
+
+_operations = {
+  "signal": _signal,
+  "exec": _exec,
+  "write": _write,
+  "mkdir": _mkdir,
+}
+
+
+def serve(input_stream: IO[str], output_stream: IO[str]) -> None:
+  for line in input_stream:
+    try:
+      request = json.loads(line)
+      results = []
+      for action in request.get("actions", []):
+        if action.get("op") in _operations:
+          results.append(_operations[action["op"]](action))
+        else:
+          results.append(_result(1, stderr="unknown operation"))
+    except (ValueError, AttributeError, TypeError):
+      results = [_result(1, stderr="malformed request")]
+    output_stream.write(json.dumps({"results": results}) + "\n")
+    output_stream.flush()
+
+
+class PrivilegedHelper(object):
+  process: subprocess.Popen
+  lock: threading.Lock
+
+  def __init__(self, command: Optional[List[str]] = None):
+    if command is None:
+      command = ["sudo", sys.executable, os.path.abspath(__file__)]
+    self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+    self.lock = threading.Lock()
+
+  def run(self, actions: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    with self.lock:
+      if self.process.poll() is not None:
+        raise PrivilegedHelperError("privileged helper is not running")
+      try:
+        self.process.stdin.write(json.dumps({"actions": actions}) + "\n")
+        self.process.stdin.flush()
+        response = self.process.stdout.readline()
+      except (OSError, ValueError):
+        raise PrivilegedHelperError("privileged helper is not reachable")
+    if len(response) == 0:
+      raise PrivilegedHelperError("privileged helper exited")
+    return json.loads(response)["results"]
+
+  def run_command(self, command: List[str]) -> subprocess.CompletedProcess:
+    result = self.run([{"op": "exec", "argv": command}])[0]
+    return subprocess.CompletedProcess(command, result["returncode"],
+                                       result["stdout"].encode(), result["stderr"].encode())
+
+  def signal(self, pids: List[int], stop: bool) -> bool:
+    result = self.run([{"op": "signal", "signal": "SIGSTOP" if stop else "SIGCONT", "pids": pids}])[0]
+    return result["returncode"] == 0
+
+  def write(self, paths: List[str], value: str) -> bool:
+    return self.write_batches([(paths, value)])
+
+  def write_batches(self, batches: List[Tuple[List[str], str]]) -> bool:
+    # All batches go out in a single request and are written in order
+    results = self.run([{"op": "write", "paths": paths, "value": value} for paths, value in batches])
+    return all(result["returncode"] == 0 for result in results)
+
+  def mkdir(self, path: str) -> bool:
+    return self.run([{"op": "mkdir", "path": path}])[0]["returncode"] == 0
+
+  def close(self) -> None:
+    if self.process.poll() is None:
+      self.process.stdin.close()
+      self.process.wait()
+
+
+def run_command(command: List[str], sudo: bool, helper: Optional[PrivilegedHelper] = None) -> subprocess.CompletedProcess:
+  if sudo and helper is not None:
+    try:
+      return helper.run_command(command)
+    except PrivilegedHelperError:
+      pass  # Fall back to a sudo call of our own
+  if sudo:
+    command = ["sudo"] + command
+  return subprocess.run(command, capture_output=True)
+
+
+if __name__ == '__main__':
+  serve(sys.stdin, sys.stdout)
@@ -14,20 +14,166 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
+import os
+import signal
 import subprocess
 import string
-from copy import copy
+import sys
+import threading
+import time
+from array import array
+from collections import deque
 from datetime import datetime
 from enum import Enum
-from typing import Dict, List, Tuple, Set
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Set
 
 import psutil
 
+from .privilegedHelper import PrivilegedHelper, PrivilegedHelperError
+from .snapshot import capture, is_replaying
+
 _valid_process_name_characters  = string.ascii_letters
 _valid_process_name_characters += string.digits
 _valid_process_name_characters += "_.-+/"
 
 
+_proc_state_to_status = {
+  "R": psutil.STATUS_RUNNING,
+  "S": psutil.STATUS_SLEEPING,
+  "D": psutil.STATUS_DISK_SLEEP,
+  "T": psutil.STATUS_STOPPED,
+  "t": psutil.STATUS_TRACING_STOP,
+  "Z": psutil.STATUS_ZOMBIE,
+  "X": psutil.STATUS_DEAD,
+  "x": psutil.STATUS_DEAD,
+  "I": psutil.STATUS_IDLE,
+}
+
+
+def read_proc_stat(pid: int) -> Optional[Tuple[str, int]]:
+  # Returns the psutil status string and the start time (in clock ticks) of a process
+  return capture("proc_stat", str(pid), lambda: _read_proc_stat(pid))
+
+
+def _read_proc_stat(pid: int) -> Optional[Tuple[str, int]]:
+  try:
+    with open(f"/proc/{pid}/stat", 'r') as inF:
+      line = inF.readline()
+  except OSError:
+    return None
+  fields = line[line.rfind(')') + 2:].split()
+  if len(fields) < 20:
+    return None
+  return _proc_state_to_status.get(fields[0], psutil.STATUS_RUNNING), int(fields[19])
+
+
+def read_task_switches(pid: int) -> Optional[int]:
+  # How often the threads of a process were scheduled in, which is how often they woke up
+  return capture("schedstat", str(pid), lambda: _read_task_switches(pid))
+
+
+def _read_task_switches(pid: int) -> Optional[int]:
+  try:
+    tids = os.listdir(f"/proc/{pid}/task")
+  except OSError:
+    return None
+  total = 0
+  for tid in tids:
+    try:
+      with open(f"/proc/{pid}/task/{tid}/schedstat", 'r') as inF:
+        total += int(inF.readline().split()[2])
+    except (OSError, IndexError, ValueError):
+      continue  # The thread exited in between
+  return total
+
+
+def read_interrupt_count() -> Optional[int]:
+  return capture("interrupts", "/proc/interrupts", _read_interrupt_count)
+
+
+def _read_interrupt_count() -> Optional[int]:
+  try:
+    with open("/proc/interrupts", 'r') as inF:
+      cpus = len(inF.readline().split())
+      total = 0
+      for line in inF:
+        for field in line.split()[1:cpus + 1]:
+          if not field.isdigit():
+            break
+          total += int(field)
+      return total
+  except OSError:
+    return None
+
+
+def _process_table(cmdline_names: Set[str]) -> List[Dict[str, Any]]:
+  table = []
+  for proc in psutil.process_iter(['name', 'pid', 'ppid', 'status', 'cpu_times']):
+    info = proc.info
+    # Comes from the same /proc/<pid>/stat read as the status, so it is free
+    cpu_times = info.pop('cpu_times')
+    info['cpu_time'] = cpu_times.user + cpu_times.system if cpu_times is not None else 0.0
+    if info['name'] in cmdline_names:
+      try:
+        info['cmdline'] = proc.cmdline()
+      except psutil.Error:
+        info['cmdline'] = []
+    table.append(info)
+  return table
+
+
+def cmdline_filtered_names(entries: List[Dict[str, Any]]) -> Set[str]:
+  # Names of the entries that filter by cmdline, the only ones that need their cmdlines
+  return set(name for entry in entries if "cmdline" in entry for name in entry["name"])
+
+
+status_names = tuple(sorted(getattr(psutil, attribute) for attribute in dir(psutil)
+                            if attribute.startswith("STATUS_")))
+_status_codes = {status: code for code, status in enumerate(status_names)}
+
+
+class ProcessGroup(object):
+  # All processes of one name, as parallel arrays
+  pids: array                          # 'i'
+  statuses: array                      # 'B', indices into status_names
+  cmdlines: Optional[List[List[str]]]  # Only for names an entry filters by cmdline
+
+  def __init__(self, keep_cmdlines: bool = False):
+    self.pids = array('i')
+    self.statuses = array('B')
+    self.cmdlines = [] if keep_cmdlines else None
+
+  def append(self, pid: int, cmdline: Optional[List[str]], status: str) -> None:
+    self.pids.append(pid)
+    self.statuses.append(_status_codes.get(status, _status_codes[psutil.STATUS_RUNNING]))
+    if self.cmdlines is not None:
+      self.cmdlines.append(cmdline or [])
+
+  def __len__(self) -> int:
+    return len(self.pids)
+
+  def __iter__(self) -> Iterable[Tuple[int, Optional[List[str]], str]]:
+    for n, pid in enumerate(self.pids):
+      yield pid, self.cmdlines[n] if self.cmdlines is not None else None, status_names[self.statuses[n]]
+
+  def with_statuses(self, statuses: Dict[int, str]) -> "ProcessGroup":
+    # Only keeps the pids that have a status
+    group = ProcessGroup(self.cmdlines is not None)
+    for pid, cmdline_list, status in self:
+      if pid in statuses:
+        group.append(pid, cmdline_list, statuses[pid])
+    return group
+
+
+def open_pidfd(pid: int) -> Optional[int]:
+  if not hasattr(os, "pidfd_open"):
+    return None
+  try:
+    return os.pidfd_open(pid)
+  except OSError:
+    return None
+
+
 def sanitize_process_name(name: str) -> str:
   output = ""
   for character in name:
@@ -37,58 +183,313 @@ def sanitize_process_name(name: str) -> str:
 
 
 class ProcessStatus(Enum):
-  RUNNING = 0
-  STOPPED = 1
-  NO_PROC = 2
-  MANY    = 3
-  ERROR   = 100
+  RUNNING   = 0
+  STOPPED   = 1
+  NO_PROC   = 2
+  MANY      = 3
+  THROTTLED = 4
+  ERROR     = 100
 
 
 class ProcessManager(object):
   sudo: bool
-  processes: Dict[str, List[Tuple[int, str, str]]]
+  helper: Optional[PrivilegedHelper]
+  processes: Dict[str, ProcessGroup]
   processes_updated: datetime
+  parents: Dict[int, int]         # pid -> ppid
+  children: Dict[int, List[int]]  # ppid -> [pid]
+  watched: Set[str]
+  cmdline_names: Set[str]
+  tracked: Dict[int, Tuple[str, int, Optional[int]]]  # pid -> (name, start time, pidfd)
+  pidfds: Dict[int, int]               # pidfd -> pid
+  wakeup_samples: Dict[int, Tuple[float, int]]  # pid -> (monotonic time, times scheduled in)
+  wakeup_rates: Dict[int, float]                # pid -> wakeups per second
+  interrupt_sample: Optional[Tuple[float, int]]
+  interrupt_rate: Optional[float]               # interrupts per second, all CPUs
+  cpu_times: Dict[int, float]                   # pid -> user + system seconds at the last full scan
+  cpu_times_updated: Optional[float]
+  cpu_usage: Dict[str, float]                   # name -> CPU seconds per second between full scans
+  lock: threading.RLock
 
-  def __init__(self, sudo: bool = True):
+  def __init__(self, sudo: bool = True, watched: Optional[Iterable[str]] = None,
+               helper: Optional[PrivilegedHelper] = None, scan: bool = True,
+               cmdline_names: Optional[Iterable[str]] = None):
     self.sudo = sudo
-    self.update_processes_information()
-
-  def signal_processes(self, name: str, cmdline_filter: str = None, stop: bool = True) -> bool:
-    command = []
-    call_results = []
-    if self.sudo:
-      command.append("sudo")
-    command.append("kill")
-    command.append("-s")
+    self.helper = helper
+    self.watched = set(watched) if watched is not None else set()
+    self.cmdline_names = set(cmdline_names) if cmdline_names is not None else set()
+    self.tracked = {}
+    self.pidfds = {}
+    self.wakeup_samples = {}
+    self.wakeup_rates = {}
+    self.interrupt_sample = None
+    self.interrupt_rate = None
+    self.cpu_times = {}
+    self.cpu_times_updated = None
+    self.cpu_usage = {}
+    self.lock = threading.RLock()
+    self.processes = {}
+    self.parents = {}
+    self.children = {}
+    self.processes_updated = datetime.now()
+    if scan:
+      self.update_processes_information()
+
+  def __getstate__(self):
+    # pidfds and the helper pipes only make sense in the process that opened them,
+    # the CPU time baseline of every process on the system is only needed there as well,
+    # and so is the process tree, tree walks only run for actions in the main process
+    # Action threads rescan while the pool pickles this, the lock keeps the copy consistent,
+    # and containers changed in place (tracked, wakeup samples) are copied while it is held
+    with self.lock:
+      state = {key: value.copy() if isinstance(value, (dict, set)) else value for key, value in self.__dict__.items()
+               if key not in ['pidfds', 'helper', 'cpu_times', 'parents', 'children', 'lock']}
+    state['pidfds'] = {}
+    state['helper'] = None
+    state['cpu_times'] = {}
+    state['cpu_times_updated'] = None
+    state['parents'] = {}
+    state['children'] = {}
+    return state
+
+  def __setstate__(self, state):
+    self.__dict__.update(state)
+    self.lock = threading.RLock()
+
+  def signal_processes(self, name: str, cmdline_filter: str = None, stop: bool = True, tree: bool = False) -> bool:
+    return self.signal_process_group([name], cmdline_filter, stop, tree)
+
+  def signal_process_group(self, names: List[str], cmdline_filter: str = None,
+                           stop: bool = True, tree: bool = False) -> bool:
+    with self.lock:
+      self.update_processes_information()
+      pids = self.get_group_pids(names, cmdline_filter, tree)
+    if not stop:
+      # Resume children before their parents
+      pids.reverse()
+    return self.signal_pids(pids, stop)
+
+  def signal_pids(self, pids: List[int], stop: bool = True) -> bool:
+    if len(pids) == 0:
+      return True
+    if not self.sudo:
+      success = True
+      for pid in pids:
+        try:
+          os.kill(pid, signal.SIGSTOP if stop else signal.SIGCONT)
+        except OSError:
+          success = False
+      return success
+    if self.helper is not None:
+      try:
+        return self.helper.signal(pids, stop)
+      except PrivilegedHelperError:
+        pass
+    command = ["sudo", "kill", "-s"]
     if stop:
       command.append("SIGSTOP")
     else:
       command.append("SIGCONT")
-    self.update_processes_information()
-    for pid, cmdline_list, status in self.processes[name]:
-      run_command = copy(command)
-      run_command.append(str(pid))
-      if cmdline_filter is None:
-        call_result = subprocess.run(run_command, capture_output=True)
-        call_results.append(call_result.returncode)
-      else:
-        for cmdline in cmdline_list:
-          if cmdline_filter in cmdline:
-            call_result = subprocess.run(run_command, capture_output=True)
-            call_results.append(call_result.returncode)
+    command += [str(pid) for pid in pids]
+    call_result = subprocess.run(command, capture_output=True)
+    return call_result.returncode == 0
 
-    if sum(call_results) == 0:
-      return True
+  def get_group_pids(self, names: List[str], cmdline_filter: str = None, tree: bool = False) -> List[int]:
+    matched = []
+    for name in names:
+      for pid, cmdline_list, status in self.processes.get(name, []):
+        if cmdline_filter is None or any(cmdline_filter in cmdline for cmdline in cmdline_list or []):
+          matched.append(pid)
+    if not tree:
+      return list(dict.fromkeys(matched))
+
+    # One breadth first walk from the topmost matched processes of all names, so a
+    # name inside the tree of another is not listed twice and parents always come first
+    matched_set = set(matched)
+    roots = [pid for pid in matched if not self.__has_ancestor_in(pid, matched_set)]
+    output = []
+    seen = set()
+    queue = deque(roots)
+    while queue:
+      pid = queue.popleft()
+      if pid in seen:
+        continue
+      seen.add(pid)
+      output.append(pid)
+      queue.extend(self.children.get(pid, []))
+    return output
+
+  def get_pids(self, name: str, cmdline_filter: str = None, tree: bool = False) -> List[int]:
+    return self.get_group_pids([name], cmdline_filter, tree)
+
+  def __has_ancestor_in(self, pid: int, pids: Set[int]) -> bool:
+    parent = self.parents.get(pid, 0)
+    while parent > 1:
+      if parent in pids:
+        return True
+      parent = self.parents.get(parent, 0)
     return False
 
   def update_processes_information(self):
-    self.processes = {}
-    for proc in psutil.process_iter(['name', 'pid', 'cmdline', 'status']):
-      if proc.info["name"] not in self.processes:
-        self.processes[proc.info["name"]] = []
-      self.processes[proc.info["name"]].append((proc.info["pid"],
-                                                proc.info["cmdline"],
-                                                proc.info["status"]))
+    with self.lock:
+      # Built aside and swapped in, readers never see a half filled table
+      processes: Dict[str, ProcessGroup] = {}
+      parents:   Dict[int, int] = {}
+      children:  Dict[int, List[int]] = {}
+      process_table = capture("processes", "process_iter", lambda: _process_table(self.cmdline_names), [])
+      for info in process_table:
+        name = sys.intern(info["name"])
+        if name not in processes:
+          processes[name] = ProcessGroup(name in self.cmdline_names)
+        processes[name].append(info["pid"], info.get("cmdline"), info["status"])
+        ppid = info["ppid"]
+        if ppid is not None:
+          parents[info["pid"]] = ppid
+          if ppid not in children:
+            children[ppid] = []
+          children[ppid].append(info["pid"])
+      self.processes = processes
+      self.parents   = parents
+      self.children  = children
+      self.processes_updated = datetime.now()
+      self.__update_cpu_usage(process_table)
+      self.__track_watched()
+      self.__sample_wakeups()
+
+  def __update_cpu_usage(self, process_table: List[Dict[str, Any]]) -> None:
+    now = capture("clock", "cpu_usage", time.monotonic)
+    if self.cpu_times_updated is not None and now - self.cpu_times_updated < 1.0:
+      # Rescans right after an action would only give noise, keep the older baseline
+      return
+    own_pid = os.getpid()
+    cpu_times = {}
+    used = {}
+    for info in process_table:
+      pid = info["pid"]
+      cpu_time = info.get("cpu_time", 0.0)
+      cpu_times[pid] = cpu_time
+      # Kernel threads can't be stopped and this process shouldn't stop itself
+      if 2 in [pid, info["ppid"]] or own_pid in [pid, info["ppid"]]:
+        continue
+      delta = cpu_time - self.cpu_times.get(pid, 0.0)
+      if delta < 0.0:
+        delta = cpu_time  # The pid got reused
+      used[info["name"]] = used.get(info["name"], 0.0) + delta
+    if self.cpu_times_updated is not None:
+      elapsed = now - self.cpu_times_updated
+      self.cpu_usage = {name: cpu_time / elapsed for name, cpu_time in used.items() if cpu_time > 0.0}
+    self.cpu_times = cpu_times
+    self.cpu_times_updated = now
+
+  def get_top_consumers(self, count: int) -> List[Tuple[str, float]]:
+    # Names no entry is configured for, by CPU use. Stopped ones stay listed, so they can be continued again.
+    unconfigured = [(name, usage) for name, usage in self.cpu_usage.items() if name not in self.watched]
+    top = sorted(unconfigured, key=lambda u: -u[1])[:count]
+    listed = set(name for name, usage in top)
+    for name, processes in self.processes.items():
+      if name not in self.watched and name not in listed and \
+         any(status == psutil.STATUS_STOPPED for pid, cmdline_list, status in processes):
+        top.append((name, self.cpu_usage.get(name, 0.0)))
+    return top
+
+  def __track_watched(self) -> None:
+    found = set()
+    for name in self.watched:
+      for pid, cmdline_list, status in self.processes.get(name, []):
+        found.add(pid)
+        if pid in self.tracked:
+          continue
+        stat = read_proc_stat(pid)
+        if stat is None:
+          continue
+        # Recorded PIDs belong to other processes on this system, or to none
+        pidfd = None if is_replaying() else open_pidfd(pid)
+        self.tracked[pid] = (name, stat[1], pidfd)
+        if pidfd is not None:
+          self.pidfds[pidfd] = pid
+    for pid in list(self.tracked.keys()):
+      if pid not in found:
+        self.__untrack(pid)
+
+  def __untrack(self, pid: int) -> None:
+    name, start_time, pidfd = self.tracked.pop(pid)
+    if pidfd is not None and self.pidfds.pop(pidfd, None) is not None:
+      os.close(pidfd)
+
+  def update_tracked_processes(self) -> None:
+    # Cheap refresh between full scans: only re-reads /proc/<pid>/stat of already matched processes
+    with self.lock:
+      statuses = {}
+      for pid in list(self.tracked.keys()):
+        stat = read_proc_stat(pid)
+        if stat is None or stat[1] != self.tracked[pid][1]:
+          self.__untrack(pid)
+        else:
+          statuses[pid] = stat[0]
+      self.__apply_tracked_statuses(statuses)
+      self.processes_updated = datetime.now()
+      self.__sample_wakeups()
+
+  def __sample_wakeups(self) -> None:
+    # Only the tracked processes are sampled, the rates are the difference to the previous pass
+    now = capture("clock", "wakeups", time.monotonic)
+    samples = {}
+    rates = {}
+    for pid in self.tracked:
+      count = read_task_switches(pid)
+      if count is None:
+        continue
+      samples[pid] = (now, count)
+      last = self.wakeup_samples.get(pid)
+      if last is not None and now > last[0]:
+        rates[pid] = max(0, count - last[1]) / (now - last[0])
+      elif pid in self.wakeup_rates:
+        rates[pid] = self.wakeup_rates[pid]
+    self.wakeup_samples = samples
+    self.wakeup_rates = rates
+
+    interrupts = read_interrupt_count()
+    if interrupts is not None:
+      if self.interrupt_sample is not None and now > self.interrupt_sample[0]:
+        self.interrupt_rate = max(0, interrupts - self.interrupt_sample[1]) / (now - self.interrupt_sample[0])
+      self.interrupt_sample = (now, interrupts)
+
+  def get_group_wakeup_rate(self, names: List[str], cmdline_filter: str = None) -> Optional[float]:
+    rates = [self.wakeup_rates[pid] for pid in self.get_group_pids(names, cmdline_filter)
+             if pid in self.wakeup_rates]
+    if len(rates) == 0:
+      return None
+    return sum(rates)
+
+  def __apply_tracked_statuses(self, statuses: Dict[int, str]) -> None:
+    for name in self.watched:
+      if name not in self.processes:
+        continue
+      self.processes[name] = self.processes[name].with_statuses(statuses)
+      if len(self.processes[name]) == 0:
+        del self.processes[name]
+
+  def get_poll_fds(self) -> List[int]:
+    return list(self.pidfds.keys())
+
+  def handle_exited(self, pidfds: Iterable[int]) -> None:
+    with self.lock:
+      exited = set()
+      for pidfd in pidfds:
+        if pidfd in self.pidfds:
+          exited.add(self.pidfds[pidfd])
+          self.__untrack(self.pidfds[pidfd])
+      for name in self.watched:
+        if name in self.processes:
+          self.processes[name] = self.processes[name].with_statuses({pid: status for pid, cmdline_list, status
+                                                                     in self.processes[name] if pid not in exited})
+          if len(self.processes[name]) == 0:
+            del self.processes[name]
+
+  def close(self) -> None:
+    with self.lock:
+      for pid in list(self.tracked.keys()):
+        self.__untrack(pid)
 
   @staticmethod
   def decode_status(status: str) -> ProcessStatus:
@@ -108,7 +509,7 @@ class ProcessManager(object):
 
     for pid, cmdline_list, status in self.processes[proc]:
       if cmdline_filter is not None:
-        for cmdline in cmdline_list:
+        for cmdline in cmdline_list or []:
           if cmdline_filter in cmdline:
             output.add(ProcessManager.decode_status(status))
       else:
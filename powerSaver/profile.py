@@ -0,0 +1,291 @@
+# powerSaver - Save power by controlling processes and services
+# Copyright (C) 2021  Nina Alexandra Klama
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from enum import Enum
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from .processManager import ProcessManager, ProcessStatus
+from .serviceManager import ServiceManager, ServiceStatus
+from .moduleManager import ModuleManager, ModuleStatus
+from .cpuFreqManager import CpuFreqManager, CpuFreqStatus
+from .devicePowerManager import DevicePowerManager, DeviceStatus
+from .cgroupManager import CgroupManager
+
+Entry = Dict[str, Any]
+
+
+class ProfileStatus(Enum):
+  ACTIVE   = 0
+  INACTIVE = 1
+  APPLYING = 2
+  ERROR    = 100
+
+
+class ProfileStep(object):
+  key: str
+  action: Callable[[], bool]
+  after: Set[str]
+
+  def __init__(self, key: str, action: Callable[[], bool]):
+    self.key = key
+    self.action = action
+    self.after = set()
+
+
+class ProfilePlan(object):
+  title: str
+  steps: Dict[str, ProfileStep]
+
+  def __init__(self, title: str):
+    self.title = title
+    self.steps = {}
+
+  def add_step(self, key: str, action: Callable[[], bool]) -> None:
+    self.steps[key] = ProfileStep(key, action)
+
+  def add_dependency(self, before: str, after: str) -> None:
+    # Dependencies on steps that are not part of the plan are already satisfied
+    if before in self.steps and after in self.steps:
+      self.steps[after].after.add(before)
+
+  def run(self, max_workers: int = 8) -> Dict[str, bool]:
+    # Imported here, freeze and thaw on the command line never run a plan
+    import concurrent.futures
+    results: Dict[str, bool] = {}
+    pending = dict(self.steps)
+    running: Dict[concurrent.futures.Future, str] = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(self.steps)))) as executor:
+      while len(pending) > 0 or len(running) > 0:
+        progress = False
+        for key, step in list(pending.items()):
+          if not all(dep in results for dep in step.after):
+            continue
+          del pending[key]
+          progress = True
+          if all(results[dep] for dep in step.after):
+            running[executor.submit(step.action)] = key
+          else:
+            results[key] = False  # Something it depends on failed
+        if len(running) == 0:
+          if not progress:
+            # Circular dependencies, nothing will ever become ready
+            for key in pending:
+              results[key] = False
+            break
+          continue
+        done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+        for future in done:
+          key = running.pop(future)
+          try:
+            results[key] = bool(future.result())
+          except Exception:
+            results[key] = False
+    return results
+
+
+def set_process_entry(process_manager: ProcessManager, cgroup_manager: Optional[CgroupManager],
+                      entry: Entry, stop: bool) -> bool:
+  pids = process_manager.get_group_pids(entry["name"], entry.get("cmdline"), bool(entry.get("tree", False)))
+  if cgroup_manager is not None:
+    if not cgroup_manager.move_pids(entry["title"], pids):
+      return False
+    if stop:
+      return cgroup_manager.freeze(entry["title"])
+    return cgroup_manager.thaw(entry["title"])
+  if not stop:
+    pids.reverse()
+  return process_manager.signal_pids(pids, stop)
+
+
+class ProfileActions(object):
+  process_manager: ProcessManager
+  service_manager: ServiceManager
+  module_manager: ModuleManager
+  cpufreq_manager: Optional[CpuFreqManager]
+  device_manager: Optional[DevicePowerManager]
+  cgroup_manager: Optional[CgroupManager]
+
+  def __init__(self,
+               process_manager: ProcessManager,
+               service_manager: ServiceManager,
+               module_manager: ModuleManager,
+               cpufreq_manager: Optional[CpuFreqManager] = None,
+               device_manager: Optional[DevicePowerManager] = None,
+               cgroup_manager: Optional[CgroupManager] = None):
+    self.process_manager = process_manager
+    self.service_manager = service_manager
+    self.module_manager = module_manager
+    self.cpufreq_manager = cpufreq_manager
+    self.device_manager = device_manager
+    self.cgroup_manager = cgroup_manager
+
+  def scan_processes(self) -> bool:
+    self.process_manager.update_processes_information()
+    return True
+
+  def set_process(self, entry: Entry, stop: bool) -> bool:
+    return set_process_entry(self.process_manager, self.cgroup_manager, entry, stop)
+
+  def set_service(self, entry: Entry, stop: bool) -> bool:
+    if stop:
+      return self.service_manager.stop_service(entry["name"])
+    return self.service_manager.start_service(entry["name"])
+
+  def set_modules(self, entry: Entry, load: bool) -> bool:
+    success = True
+    if load:
+      for module in entry["modules"]:
+        success = self.module_manager.load_module(module) and success
+    else:
+      for module in reversed(entry["modules"]):
+        if self.module_manager.get_module_status(module) == ModuleStatus.LOADED:
+          success = self.module_manager.unload_module(module) and success
+    return success
+
+  def apply_cpufreq(self, entry: Entry) -> bool:
+    if self.cpufreq_manager is None:
+      return False
+    return self.cpufreq_manager.apply(entry)
+
+  def set_devices(self, entry: Entry, auto: bool) -> bool:
+    if self.device_manager is None:
+      return False
+    return self.device_manager.set_control(entry, auto)
+
+
+def _find(entries: List[Entry], key: str, value: str) -> Optional[Entry]:
+  for entry in entries:
+    if entry.get(key) == value:
+      return entry
+  return None
+
+
+def _process_target_reached(entry: Entry, target: str) -> bool:
+  if entry.get("status") == ProcessStatus.NO_PROC:
+    return True
+  if target == "stopped":
+    return entry.get("status") == ProcessStatus.STOPPED
+  return entry.get("status") == ProcessStatus.RUNNING
+
+
+def _service_target_reached(entry: Entry, target: str) -> bool:
+  if target == "stopped":
+    return entry.get("status") in [ServiceStatus.STOPPED, ServiceStatus.NOT_FOUND]
+  return entry.get("status") in [ServiceStatus.RUNNING, ServiceStatus.INACTIVE]
+
+
+def _module_target_reached(entry: Entry, target: str) -> bool:
+  if target == "unloaded":
+    return entry.get("status") == ModuleStatus.NOT_LOADED
+  return entry.get("status") in [ModuleStatus.LOADED, ModuleStatus.USED]
+
+
+def _device_target_reached(entry: Entry, target: str) -> bool:
+  if target == "auto":
+    return entry.get("status") == DeviceStatus.AUTO
+  return entry.get("status") == DeviceStatus.ON
+
+
+def _modules_serve(module_set: Entry, service: Entry) -> bool:
+  if module_set.get("service") == service["name"]:
+    return True
+  return len(set(service.get("needs-modules", [])) & set(module_set.get("modules", []))) > 0
+
+
+def profile_steps(profile: Entry,
+                  processes: List[Entry],
+                  services: List[Entry],
+                  modules: List[Entry],
+                  cpufreq: List[Entry],
+                  devices: List[Entry]) -> List[Tuple[str, Entry, str]]:
+  # (section, entry, target) for every entry that is not in the target state yet
+  output = []
+  for title, target in profile.get("processes", {}).items():
+    entry = _find(processes, "title", title)
+    if entry is not None and not _process_target_reached(entry, target):
+      output.append(("processes", entry, target))
+  for title, target in profile.get("services", {}).items():
+    entry = _find(services, "title", title)
+    if entry is not None and not _service_target_reached(entry, target):
+      output.append(("services", entry, target))
+  for title, target in profile.get("modules", {}).items():
+    entry = _find(modules, "title", title)
+    if entry is not None and not _module_target_reached(entry, target):
+      output.append(("modules", entry, target))
+  if "cpufreq" in profile:
+    entry = _find(cpufreq, "title", profile["cpufreq"])
+    if entry is not None and entry.get("status") != CpuFreqStatus.ACTIVE:
+      output.append(("cpufreq", entry, "active"))
+  for title, target in profile.get("devices", {}).items():
+    entry = _find(devices, "title", title)
+    if entry is not None and not _device_target_reached(entry, target):
+      output.append(("devices", entry, target))
+  return output
+
+
+def get_profile_status(profile: Entry,
+                       processes: List[Entry],
+                       services: List[Entry],
+                       modules: List[Entry],
+                       cpufreq: List[Entry],
+                       devices: List[Entry]) -> ProfileStatus:
+  if len(profile_steps(profile, processes, services, modules, cpufreq, devices)) == 0:
+    return ProfileStatus.ACTIVE
+  return ProfileStatus.INACTIVE
+
+
+def compile_profile(profile: Entry,
+                    processes: List[Entry],
+                    services: List[Entry],
+                    modules: List[Entry],
+                    cpufreq: List[Entry],
+                    devices: List[Entry],
+                    actions: ProfileActions) -> ProfilePlan:
+  plan = ProfilePlan(profile["title"])
+  steps = profile_steps(profile, processes, services, modules, cpufreq, devices)
+
+  if any(section == "processes" for section, entry, target in steps):
+    plan.add_step("scan", actions.scan_processes)
+
+  for section, entry, target in steps:
+    key = f"{section}/{entry['title']}"
+    if section == "processes":
+      plan.add_step(key, lambda e=entry, t=target: actions.set_process(e, t == "stopped"))
+      plan.add_dependency("scan", key)
+    elif section == "services":
+      plan.add_step(key, lambda e=entry, t=target: actions.set_service(e, t == "stopped"))
+    elif section == "modules":
+      plan.add_step(key, lambda e=entry, t=target: actions.set_modules(e, t == "loaded"))
+    elif section == "cpufreq":
+      plan.add_step(key, lambda e=entry: actions.apply_cpufreq(e))
+    elif section == "devices":
+      plan.add_step(key, lambda e=entry, t=target: actions.set_devices(e, t == "auto"))
+
+  # Services have to be stopped before the modules they use are unloaded,
+  # and the modules have to be loaded before the services are started
+  for service_section, service, service_target in steps:
+    if service_section != "services":
+      continue
+    for module_section, module_set, module_target in steps:
+      if module_section != "modules" or not _modules_serve(module_set, service):
+        continue
+      service_key = f"services/{service['title']}"
+      module_key = f"modules/{module_set['title']}"
+      if service_target == "stopped" and module_target == "unloaded":
+        plan.add_dependency(service_key, module_key)
+      elif service_target != "stopped" and module_target == "loaded":
+        plan.add_dependency(module_key, service_key)
+  return plan
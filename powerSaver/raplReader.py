@@ -0,0 +1,100 @@
+# powerSaver - Save power by controlling processes and services
+# Copyright (C) 2021  Nina Alexandra Klama
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from .snapshot import capture
+from .sysfs import read_attribute
+
+# Energy counters only change about every millisecond, shorter intervals are mostly noise
+min_interval = 0.05
+
+
+def is_package(name: str) -> bool:
+  # psys (intel-rapl:1) is the whole platform already, it would count the packages twice
+  return name.startswith("package-") and "/" not in name
+
+
+class RaplDomain(object):
+  name: str                      # "package-0", or "package-0/core" for a subzone
+  path: Path
+  max_energy: int                # µJ, the counter wraps around after this
+  last_energy: Optional[int] = None
+  last_time: Optional[float] = None
+  watts: Optional[float] = None
+
+  def __init__(self, name: str, path: Path, max_energy: int):
+    self.name = name
+    self.path = path
+    self.max_energy = max_energy
+
+  def update(self, now: float) -> None:
+    energy = capture("sysfs", str(self.path / "energy_uj"), lambda: read_attribute(self.path / "energy_uj"))
+    if energy is None or not energy.isdigit():
+      # Since the Platypus fixes energy_uj is only readable by root
+      self.watts = None
+      self.last_energy = None
+      return
+    energy = int(energy)
+    if self.last_energy is not None and now - self.last_time >= min_interval:
+      delta = energy - self.last_energy
+      if delta < 0:
+        delta += self.max_energy
+      self.watts = delta / 1e6 / (now - self.last_time)
+    elif self.last_energy is not None:
+      return
+    self.last_energy = energy
+    self.last_time = now
+
+
+class RaplReader(object):
+  root: Path
+  domains: List[RaplDomain]
+
+  def __init__(self, root: str = "/sys/class/powercap"):
+    self.root = Path(root)
+    self.domains = []
+    # Subzones show up next to their package as intel-rapl:<package>:<n>
+    names = {}
+    for zone in sorted(self.root.glob("intel-rapl:*")):
+      name = read_attribute(zone / "name")
+      max_energy = read_attribute(zone / "max_energy_range_uj")
+      if name is None or max_energy is None or not (zone / "energy_uj").exists():
+        continue
+      names[zone.name] = name
+      package = zone.name.rsplit(":", 1)[0]
+      if package in names:
+        name = f"{names[package]}/{name}"
+      self.domains.append(RaplDomain(name, zone, int(max_energy)))
+
+  def available(self) -> bool:
+    return len(self.domains) > 0
+
+  def update(self) -> None:
+    now = capture("clock", "rapl", time.monotonic)
+    for domain in self.domains:
+      domain.update(now)
+
+  def get_watts(self) -> Dict[str, float]:
+    return {domain.name: domain.watts for domain in self.domains if domain.watts is not None}
+
+  def package_watts(self) -> Optional[float]:
+    packages = [domain.watts for domain in self.domains if is_package(domain.name) and domain.watts is not None]
+    if len(packages) == 0:
+      return None
+    return sum(packages)
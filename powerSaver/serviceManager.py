@@ -16,12 +16,14 @@
 
 
 from enum import Enum
-from typing import Callable, Dict, List, Optional
+from typing import Callable, Dict, List, Optional, Tuple
 
 import re
 import os
 import os.path
-import subprocess
+
+from .privilegedHelper import PrivilegedHelper, run_command
+from .snapshot import capture
 
 
 def is_exe(path: str) -> bool:
@@ -50,8 +52,10 @@ class ServiceManager(object):
   functions: Dict[str, Callable]
   sudo: bool
   debug: bool
+  helper: Optional[PrivilegedHelper]
 
-  def __init__(self, init_type: str, sudo: bool = False, debug: bool = False):
+  def __init__(self, init_type: str, sudo: bool = False, debug: bool = False,
+               helper: Optional[PrivilegedHelper] = None):
     function_db = {
       "sysvinit": {
         "get_status": ServiceManager._get_status_init,
@@ -75,45 +79,51 @@ class ServiceManager(object):
       self.functions = function_db["sysvinit"]
     self.sudo = sudo
     self.debug = debug
+    self.helper = helper
+
+  def __getstate__(self):
+    # The helper pipes stay in this process, pickled copies fall back to sudo
+    state = self.__dict__.copy()
+    state["helper"] = None
+    return state
 
   def get_status(self, name: str) -> ServiceStatus:
-    return self.functions["get_status"](name, self.sudo, self.debug)
+    return self.functions["get_status"](name, self.sudo, self.debug, self.helper)
 
   def start_service(self, name: str) -> bool:
-    return self.functions["start_service"](name, self.sudo, self.debug)
+    return self.functions["start_service"](name, self.sudo, self.debug, self.helper)
 
   def stop_service(self, name: str) -> bool:
-    return self.functions["stop_service"](name, self.sudo, self.debug)
+    return self.functions["stop_service"](name, self.sudo, self.debug, self.helper)
 
   def toggle_service(self, name: str) -> bool:
-    return self.functions["toggle_service"](name, self.sudo, self.debug)
+    return self.functions["toggle_service"](name, self.sudo, self.debug, self.helper)
 
   @staticmethod
   def _unimplemented_function(*_):
     raise ServiceStatusFunctionUnimplemented
 
   @staticmethod
-  def __create_service_command_init(name: str, sudo: bool) -> Optional[List[str]]:
+  def __create_service_command_init(name: str) -> Optional[List[str]]:
     command = []
-    if sudo:
-      command.append("sudo")
     script = "/etc/init.d/" + name
-    if not is_exe(script):
+    if not capture("exists", script, lambda: is_exe(script), False):
       return None
     command.append("/sbin/rc-service")
     command.append(name)
     return command
 
   @staticmethod
-  def _get_status_init(name: str, sudo: bool, debug: bool) -> ServiceStatus:
-    command = ServiceManager.__create_service_command_init(name, sudo)
+  def _get_status_init(name: str, sudo: bool, debug: bool, helper: Optional[PrivilegedHelper] = None) -> ServiceStatus:
+    command = ServiceManager.__create_service_command_init(name)
     if command is None:
       return ServiceStatus.NOT_FOUND
     command.append("status")
 
-    status_result = subprocess.run(command, capture_output=True)
-    status_output = status_result.stdout.decode()
-    status_output += status_result.stderr.decode()
+    def run_status() -> Tuple[int, str]:
+      run_result = run_command(command, sudo, helper)
+      return run_result.returncode, run_result.stdout.decode() + run_result.stderr.decode()
+    returncode, status_output = capture("service", " ".join(command), run_status, (1, ""))
 
     status = None
     match = sysvinit_status_parser.match(status_output)
@@ -134,36 +144,36 @@ class ServiceManager(object):
 
     if debug:
       with open('.error_service', 'ab') as outF:
-        err_str = f"{name}: [{status_result.returncode}] {status_output} -> {status}\n"
+        err_str = f"{name}: [{returncode}] {status_output} -> {status}\n"
         os.write(outF.fileno(), err_str.encode())
 
     return ServiceStatus.UNKNOWN
 
   @staticmethod
-  def __zap_if_crashed(status: ServiceStatus, command: List[str]) -> bool:
+  def __zap_if_crashed(status: ServiceStatus, command: List[str], sudo: bool,
+                       helper: Optional[PrivilegedHelper]) -> bool:
     if status == ServiceStatus.CRASHED:
-      zap_command = command
-      zap_command.append("zap")
-      subprocess.run(zap_command)
+      zap_command = command + ["zap"]
+      run_command(zap_command, sudo, helper)
       return True
     return False
 
   @staticmethod
-  def _start_service_init(name: str, sudo: bool, debug: bool) -> bool:
-    command = ServiceManager.__create_service_command_init(name, sudo)
+  def _start_service_init(name: str, sudo: bool, debug: bool, helper: Optional[PrivilegedHelper] = None) -> bool:
+    command = ServiceManager.__create_service_command_init(name)
     if command is None:
       return False
 
-    status = ServiceManager._get_status_init(name, sudo, debug)
+    status = ServiceManager._get_status_init(name, sudo, debug, helper)
     if status in [ServiceStatus.RUNNING, ServiceStatus.INACTIVE]:
       return True
-    elif ServiceManager.__zap_if_crashed(status, command):
+    elif ServiceManager.__zap_if_crashed(status, command, sudo, helper):
       pass
     elif status != ServiceStatus.STOPPED:
       return False
 
     command.append("start")
-    run_result = subprocess.run(command, capture_output=True)
+    run_result = run_command(command, sudo, helper)
     if run_result.returncode != 0:
       if debug:
         with open('.error_service', 'ab') as outF:
@@ -174,30 +184,30 @@ class ServiceManager(object):
     return True
 
   @staticmethod
-  def _stop_service_init(name: str, sudo: bool, debug: bool) -> bool:
-    command = ServiceManager.__create_service_command_init(name, sudo)
+  def _stop_service_init(name: str, sudo: bool, debug: bool, helper: Optional[PrivilegedHelper] = None) -> bool:
+    command = ServiceManager.__create_service_command_init(name)
     if command is None:
       return False
 
-    status = ServiceManager._get_status_init(name, sudo, debug)
+    status = ServiceManager._get_status_init(name, sudo, debug, helper)
     if status == ServiceStatus.STOPPED:
       return True
-    if ServiceManager.__zap_if_crashed(status, command):
+    if ServiceManager.__zap_if_crashed(status, command, sudo, helper):
       return True
     elif status not in [ServiceStatus.RUNNING, ServiceStatus.INACTIVE]:
       return False
 
     command.append("stop")
-    run_result = subprocess.run(command, capture_output=True)
+    run_result = run_command(command, sudo, helper)
     if run_result.returncode != 0:
       return False
     return True
 
   @staticmethod
-  def _toggle_service_init(name: str, sudo: bool, debug: bool) -> bool:
-    status = ServiceManager._get_status_init(name, sudo, debug)
+  def _toggle_service_init(name: str, sudo: bool, debug: bool, helper: Optional[PrivilegedHelper] = None) -> bool:
+    status = ServiceManager._get_status_init(name, sudo, debug, helper)
     if status in [ServiceStatus.STOPPED, ServiceStatus.CRASHED]:
-      return ServiceManager._start_service_init(name, sudo, debug)
+      return ServiceManager._start_service_init(name, sudo, debug, helper)
     elif status == ServiceStatus.RUNNING:
-      return ServiceManager._stop_service_init(name, sudo, debug)
+      return ServiceManager._stop_service_init(name, sudo, debug, helper)
     return False
@@ -0,0 +1,126 @@
+# powerSaver - Save power by controlling processes and services
+# Copyright (C) 2021  Nina Alexandra Klama
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Records the raw system inputs (process table, module list, service status
+# output, battery sysfs reads, clocks) to a gzipped JSON lines file, one
+# [seconds since start, kind, key, value] event per line, and feeds them
+# back in the same order per (kind, key) when replaying.
+
+import gzip
+import json
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+
+
+class SnapshotRecorder(object):
+  start: float
+  lock: threading.Lock
+
+  def __init__(self, path: str):
+    self.out = gzip.open(path, 'wt')
+    self.start = time.monotonic()
+    self.lock = threading.Lock()
+
+  def add(self, kind: str, key: str, value: Any) -> None:
+    line = json.dumps([round(time.monotonic() - self.start, 4), kind, key, value], separators=(",", ":"))
+    with self.lock:
+      self.out.write(line + "\n")
+
+  def close(self) -> None:
+    with self.lock:
+      self.out.close()
+
+
+class SnapshotReplayer(object):
+  events: Dict[Tuple[str, str], Deque[Any]]
+  last: Dict[Tuple[str, str], Any]
+  remaining: int
+  lock: threading.Lock
+
+  def __init__(self, path: str):
+    self.events = {}
+    self.last = {}
+    self.remaining = 0
+    self.lock = threading.Lock()
+    with gzip.open(path, 'rt') as inF:
+      for line in inF:
+        _, kind, key, value = json.loads(line)
+        self.events.setdefault((kind, key), deque()).append(value)
+        self.remaining += 1
+
+  def next(self, kind: str, key: str, default: Any) -> Any:
+    # Once a key runs out its last value is repeated, so the pipeline never stalls
+    with self.lock:
+      events = self.events.get((kind, key))
+      if events is not None and len(events) > 0:
+        self.last[(kind, key)] = events.popleft()
+        self.remaining -= 1
+      return self.last.get((kind, key), default)
+
+  def finished(self) -> bool:
+    return self.remaining == 0
+
+
+_recorder: Optional[SnapshotRecorder] = None
+_replayer: Optional[SnapshotReplayer] = None
+
+
+def start_recording(path: str) -> None:
+  global _recorder
+  _recorder = SnapshotRecorder(path)
+
+
+def start_replay(path: str) -> None:
+  global _replayer
+  _replayer = SnapshotReplayer(path)
+
+
+def stop() -> None:
+  global _recorder, _replayer
+  if _recorder is not None:
+    _recorder.close()
+  _recorder = None
+  _replayer = None
+
+
+def is_active() -> bool:
+  return _recorder is not None or _replayer is not None
+
+
+def is_replaying() -> bool:
+  return _replayer is not None
+
+
+def replay_finished() -> bool:
+  return _replayer is not None and _replayer.finished()
+
+
+def replay_remaining() -> int:
+  if _replayer is None:
+    return 0
+  return _replayer.remaining
+
+
+def capture(kind: str, key: str, read: Callable[[], Any], default: Any = None) -> Any:
+  # Values have to survive a JSON round trip, tuples come back as lists
+  if _replayer is not None:
+    return _replayer.next(kind, key, default)
+  value = read()
+  if _recorder is not None:
+    _recorder.add(kind, key, value)
+  return value
@@ -0,0 +1,80 @@
+# powerSaver - Save power by controlling processes and services
+# Copyright (C) 2021  Nina Alexandra Klama
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import curses
+from collections import deque
+from typing import Callable, Deque, Sequence, Tuple
+
+block_ramp = "▁▂▃▄▅▆▇█"
+ascii_ramp = "_.-=+*#@"
+
+
+class Sparkline(object):
+  # One column per sample, newest on the right. The scale is fixed, so a new
+  # sample never changes the older columns: drawing it shifts the row left by
+  # one column and only writes the new cell.
+  width: int
+  scale: float
+  ramp: str
+  color: Callable[[float], int]    # watts -> curses attribute
+  label: str
+  cells: Deque[Tuple[str, int]]
+  seen: int                        # samples of the history already turned into cells
+  undrawn: int                     # cells added since the last draw
+  full_redraw: bool
+
+  def __init__(self, width: int, scale: float, color: Callable[[float], int], ramp: str = block_ramp):
+    self.scale = max(scale, 0.1)
+    self.ramp = ramp
+    self.color = color
+    self.label = f"{self.scale:.0f}W "
+    self.seen = 0
+    self.set_width(width)
+
+  def set_width(self, width: int) -> None:
+    self.width = max(1, width - len(self.label))
+    self.cells = deque([(" ", curses.A_NORMAL)] * self.width, maxlen=self.width)
+    self.undrawn = 0
+    self.full_redraw = True
+    self.seen = 0
+
+  def __cell(self, watts: float) -> Tuple[str, int]:
+    level = min(len(self.ramp) - 1, max(0, int(watts / self.scale * len(self.ramp))))
+    return self.ramp[level], self.color(watts)
+
+  def update(self, history: Sequence[float], total: int) -> None:
+    # total: samples ever added to the history, the history itself is bounded
+    new = min(total - self.seen, len(history), self.width)
+    for n in range(len(history) - new, len(history)):
+      self.cells.append(self.__cell(history[n]))
+    self.undrawn += new
+    self.seen = total
+
+  def draw(self, screen: curses.window, y: int) -> None:
+    if self.full_redraw or self.undrawn >= self.width:
+      screen.move(y, 0)
+      screen.clrtoeol()
+      screen.addstr(y, 0, self.label)
+      for x, (character, attr) in enumerate(self.cells):
+        screen.addstr(y, len(self.label) + x, character, attr)
+      self.full_redraw = False
+    else:
+      right = len(self.label) + self.width - 1
+      for character, attr in list(self.cells)[self.width - self.undrawn:]:
+        screen.move(y, len(self.label))
+        screen.delch()
+        screen.addstr(y, right, character, attr)
+    self.undrawn = 0
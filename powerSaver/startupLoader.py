@@ -0,0 +1,92 @@
+# powerSaver - Save power by controlling processes and services
+# Copyright (C) 2021  Nina Alexandra Klama
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import concurrent.futures
+import os
+import time
+from typing import Any, Callable, Dict, List, Sequence
+
+
+class StartupLoader(object):
+  # Runs the slow parts of the startup side by side. Tasks can need the
+  # results of earlier tasks, those are waited for inside the worker and
+  # passed in front of the other arguments.
+  executor: concurrent.futures.ThreadPoolExecutor
+  tasks: Dict[str, concurrent.futures.Future]
+  started: float                 # time.monotonic()
+  finished: Dict[str, float]     # name -> seconds after started
+
+  def __init__(self, max_workers: int = 8):
+    self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+    self.tasks = {}
+    self.started = time.monotonic()
+    self.finished = {}
+    # Finished tasks write a byte here, so the UI can poll() for them
+    self.wakeup_read, self.wakeup_write = os.pipe()
+    os.set_blocking(self.wakeup_read, False)
+
+  def fileno(self) -> int:
+    return self.wakeup_read
+
+  def submit(self, name: str, function: Callable, *args, needs: Sequence[str] = (), **kwargs) -> None:
+    # With a single worker the tasks run in the order they were submitted,
+    # so the needed tasks have to be submitted first
+    def run() -> Any:
+      return function(*[self.tasks[n].result() for n in needs], *args, **kwargs)
+    future = self.executor.submit(run)
+    future.add_done_callback(lambda _: self.__done(name))
+    self.tasks[name] = future
+
+  def __done(self, name: str) -> None:
+    self.finished[name] = time.monotonic() - self.started
+    try:
+      os.write(self.wakeup_write, b"\0")
+    except OSError:
+      pass
+
+  def poll(self) -> List[str]:
+    # Names of all finished tasks
+    try:
+      while len(os.read(self.wakeup_read, 4096)) > 0:
+        pass
+    except BlockingIOError:
+      pass
+    return [name for name, future in self.tasks.items() if future.done()]
+
+  def is_done(self, name: str) -> bool:
+    return self.tasks[name].done()
+
+  def all_done(self) -> bool:
+    return all(future.done() for future in self.tasks.values())
+
+  def pending(self) -> List[str]:
+    return [name for name, future in self.tasks.items() if not future.done()]
+
+  def result(self, name: str) -> Any:
+    # Exceptions of the task are raised here, in the thread asking for it
+    return self.tasks[name].result()
+
+  def elapsed(self) -> float:
+    if len(self.finished) == len(self.tasks):
+      return max(self.finished.values(), default=0.0)
+    return time.monotonic() - self.started
+
+  def shutdown(self) -> None:
+    for future in self.tasks.values():
+      future.cancel()
+    self.executor.shutdown()
+    os.close(self.wakeup_read)
+    os.close(self.wakeup_write)
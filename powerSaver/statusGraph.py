@@ -0,0 +1,110 @@
+# powerSaver - Save power by controlling processes and services
+# Copyright (C) 2021  Nina Alexandra Klama
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import concurrent.futures
+from enum import Enum
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from .entryStatus import derive_service_status, derive_module_status
+from .moduleManager import ModuleManager
+from .serviceManager import ServiceManager
+
+Entry = Dict[str, Any]
+Leaf  = Tuple[str, str]  # ("service", init script name) or ("module", kernel module name)
+Node  = Tuple[str, int]  # ("services" or "modules", index of the entry)
+
+
+class StatusGraph(object):
+  # Kernel modules and init scripts are the leaves, module set and service
+  # entries are derived from them. Every leaf is queried once per refresh and
+  # only the entries with a changed leaf are derived again.
+  services: List[Entry]
+  modules: List[Entry]
+  dependents: Dict[Leaf, List[Node]]
+  leaves: Optional[Dict[Leaf, Enum]]  # None until the first refresh
+  derived: Dict[Node, Enum]
+
+  def __init__(self, services: List[Entry], modules: List[Entry]):
+    self.services = services
+    self.modules = modules
+    self.dependents = {}
+    self.leaves = None
+    self.derived = {}
+    for n, s in enumerate(services):
+      self.__depend(("service", s["name"]), ("services", n))
+      for mod in s.get("needs-modules", []):
+        self.__depend(("module", mod), ("services", n))
+    for n, m in enumerate(modules):
+      if "service" in m:
+        self.__depend(("service", m["service"]), ("modules", n))
+      for mod in m.get("usage-modules", []):
+        self.__depend(("module", mod), ("modules", n))
+
+  def __depend(self, leaf: Leaf, node: Node) -> None:
+    dependents = self.dependents.setdefault(leaf, [])
+    if node not in dependents:
+      dependents.append(node)
+
+  def refreshed(self) -> bool:
+    return self.leaves is not None
+
+  def __service_status(self, name: str) -> Enum:
+    return self.leaves[("service", name)]
+
+  def __module_status(self, name: str) -> Enum:
+    return self.leaves[("module", name)]
+
+  def __derive(self, node: Node) -> Enum:
+    section, n = node
+    if section == "services":
+      return derive_service_status(self.services[n], self.__service_status, self.__module_status)
+    return derive_module_status(self.modules[n], self.__service_status, self.__module_status)
+
+  def refresh(self,
+              service_manager: ServiceManager,
+              module_manager: ModuleManager,
+              executor: Optional[concurrent.futures.Executor] = None) -> Set[Node]:
+    # Service states need a fork each, with an executor they are queried at once
+    service_names = [name for kind, name in self.dependents if kind == "service"]
+    if executor is not None:
+      service_states = list(executor.map(service_manager.get_status, service_names))
+    else:
+      service_states = [service_manager.get_status(name) for name in service_names]
+    leaves: Dict[Leaf, Enum] = {("service", name): status for name, status in zip(service_names, service_states)}
+    for kind, name in self.dependents:
+      if kind == "module":
+        leaves[(kind, name)] = module_manager.get_module_status(name)
+
+    dirty = set()
+    for leaf, status in leaves.items():
+      if self.leaves is None or self.leaves.get(leaf) != status:
+        dirty.update(self.dependents[leaf])
+    # Entries without any leaf are only derived once
+    dirty.update(node for node in self.__nodes() if node not in self.derived)
+    self.leaves = leaves
+    for node in dirty:
+      self.derived[node] = self.__derive(node)
+
+    # Actions set the status of an entry directly, the graph has the last word
+    for (section, n), status in self.derived.items():
+      if section == "services":
+        self.services[n]["status"] = status
+      else:
+        self.modules[n]["status"] = status
+    return dirty
+
+  def __nodes(self) -> List[Node]:
+    return [("services", n) for n in range(len(self.services))] + [("modules", n) for n in range(len(self.modules))]
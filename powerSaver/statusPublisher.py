@@ -0,0 +1,96 @@
+# powerSaver - Save power by controlling processes and services
+# Copyright (C) 2021  Nina Alexandra Klama
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import math
+import mmap
+import os
+from typing import Optional
+
+from .metricsExporter import Sample
+from .raplReader import is_package
+from .statusReader import (magic, version, max_entries, header_format, body_format, entry_format,
+                           sequence_format, sequence_offset, record_size)
+
+
+def _encode(value: str, size: int) -> bytes:
+  # Cut on a character boundary, so the reader can always decode it
+  encoded = value.encode("utf-8")[:size]
+  return encoded.decode("utf-8", errors="ignore").encode("utf-8")
+
+
+class StatusPublisher(object):
+  # Writes a fixed size record into a memory mapped file, guarded by a seqlock:
+  # the sequence is odd while the record is written, readers retry until they
+  # read the same even sequence before and after the record.
+  path: Optional[str]
+  map: Optional[mmap.mmap]
+  sequence: int
+
+  def __init__(self, path: Optional[str]):
+    self.path = path
+    self.map = None
+    self.sequence = 0
+    if path is None:
+      return
+    try:
+      fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+      try:
+        os.ftruncate(fd, record_size)
+        self.map = mmap.mmap(fd, record_size)
+      finally:
+        os.close(fd)
+    except OSError:
+      self.map = None
+      return
+    # Continue the sequence of a previous run, readers may still have the file mapped
+    record_magic, _, _, sequence = header_format.unpack_from(self.map, 0)
+    if record_magic == magic:
+      self.sequence = sequence + sequence % 2
+    header_format.pack_into(self.map, 0, magic, version, max_entries, self.sequence)
+
+  def enabled(self) -> bool:
+    return self.map is not None
+
+  def publish(self, sample: Sample) -> None:
+    if self.map is None:
+      return
+    battery = sample.get("battery")
+    load = sample.get("load", [math.nan] * 3)
+    packages = [watts for domain, watts in sample.get("rapl", {}).items() if is_package(domain)]
+    entries = list(sample["entries"].items())[:max_entries]
+
+    self.sequence += 1
+    sequence_format.pack_into(self.map, sequence_offset, self.sequence)
+    body_format.pack_into(self.map, header_format.size,
+                          sample["time"],
+                          _encode(battery["status"], 12) if battery is not None else b"",
+                          battery["percent"] if battery is not None else math.nan,
+                          battery["watts"] if battery is not None else math.nan,
+                          *load,
+                          sum(packages) if len(packages) > 0 else math.nan,
+                          len(entries))
+    offset = header_format.size + body_format.size
+    for key, status in entries:
+      section, title = key.split("/", 1)
+      entry_format.pack_into(self.map, offset, _encode(section, 12), _encode(title, 64), _encode(status, 12))
+      offset += entry_format.size
+    self.sequence += 1
+    sequence_format.pack_into(self.map, sequence_offset, self.sequence)
+
+  def close(self) -> None:
+    if self.map is not None:
+      self.map.close()
+      self.map = None
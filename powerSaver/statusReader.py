@@ -0,0 +1,127 @@
+# powerSaver - Save power by controlling processes and services
+# Copyright (C) 2021  Nina Alexandra Klama
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+# Reads the status record powerSaver publishes (see statusPublisher.py).
+# Only needs the standard library, bars and scripts can copy this file or
+# run it to print the record as JSON: python statusReader.py [path]
+#
+# Layout, little endian:
+#   header  magic, version, entry capacity, sequence (odd while being written)
+#   body    time, battery status, percent, watts, 3 load averages, CPU package watts, entry count
+#   entries section, title, status, UTF-8 and zero padded
+# Missing figures are NaN, a missing battery has an empty status.
+
+import math
+import mmap
+import os
+import struct
+import time
+from typing import Any, Dict, Optional
+
+magic       = b"PSVS"
+version     = 1
+max_entries = 128
+
+header_format = struct.Struct("<4sHHQ")
+body_format   = struct.Struct("<d12sdd3ddH")
+entry_format  = struct.Struct("<12s64s12s")
+sequence_format = struct.Struct("<Q")
+sequence_offset = 8
+
+record_size = header_format.size + body_format.size + max_entries * entry_format.size
+
+
+def default_status_path() -> str:
+  return f"/run/user/{os.getuid()}/powerSaver.status"
+
+
+def _text(value: bytes) -> str:
+  return value.rstrip(b"\0").decode("utf-8", errors="replace")
+
+
+class StatusReader(object):
+  path: str
+  map: Optional[mmap.mmap]
+
+  def __init__(self, path: Optional[str] = None):
+    self.path = path if path is not None else default_status_path()
+    self.map = None
+
+  def __open(self) -> bool:
+    try:
+      with open(self.path, 'rb') as inF:
+        if os.fstat(inF.fileno()).st_size < record_size:
+          return False
+        self.map = mmap.mmap(inF.fileno(), record_size, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+      return False
+    record_magic, record_version, _, _ = header_format.unpack_from(self.map, 0)
+    if record_magic != magic or record_version != version:
+      self.close()
+      return False
+    return True
+
+  def sequence(self) -> Optional[int]:
+    # Changes with every update, cheap to poll before reading everything
+    if self.map is None and not self.__open():
+      return None
+    return sequence_format.unpack_from(self.map, sequence_offset)[0]
+
+  def read(self, retries: int = 100) -> Optional[Dict[str, Any]]:
+    if self.map is None and not self.__open():
+      return None
+    for _ in range(retries):
+      before = sequence_format.unpack_from(self.map, sequence_offset)[0]
+      if before % 2 == 1:
+        time.sleep(0)  # The writer is in the middle of an update
+        continue
+      sample = self.__parse()
+      if sequence_format.unpack_from(self.map, sequence_offset)[0] == before:
+        sample["sequence"] = before
+        return sample
+    return None
+
+  def __parse(self) -> Dict[str, Any]:
+    record_time, battery_status, percent, watts, load_1, load_5, load_15, cpu_watts, entry_count = \
+      body_format.unpack_from(self.map, header_format.size)
+    sample: Dict[str, Any] = {"time": record_time}
+    if len(_text(battery_status)) > 0:
+      sample["battery"] = {"status": _text(battery_status), "percent": percent, "watts": watts}
+      sample["load"] = [load_1, load_5, load_15]
+    if not math.isnan(cpu_watts):
+      sample["cpu_watts"] = cpu_watts
+    sample["entries"] = {}
+    offset = header_format.size + body_format.size
+    for _ in range(min(entry_count, max_entries)):
+      section, title, status = entry_format.unpack_from(self.map, offset)
+      sample["entries"][f"{_text(section)}/{_text(title)}"] = _text(status)
+      offset += entry_format.size
+    return sample
+
+  def close(self) -> None:
+    if self.map is not None:
+      self.map.close()
+      self.map = None
+
+
+if __name__ == '__main__':
+  import json
+  import sys
+  status = StatusReader(sys.argv[1] if len(sys.argv) > 1 else None).read()
+  if status is None:
+    print("No powerSaver status available", file=sys.stderr)
+    sys.exit(1)
+  print(json.dumps(status))
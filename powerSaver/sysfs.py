@@ -0,0 +1,67 @@
+# powerSaver - Save power by controlling processes and services
+# Copyright (C) 2021  Nina Alexandra Klama
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import subprocess
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from .privilegedHelper import PrivilegedHelper, PrivilegedHelperError
+
+
+def read_attribute(path: Path) -> Optional[str]:
+  try:
+    with open(path, 'r') as inF:
+      return inF.readline().strip()
+  except OSError:
+    return None
+
+
+def write_attribute_batches(batches: List[Tuple[List[Path], str]], sudo: bool,
+                            helper: Optional[PrivilegedHelper] = None) -> bool:
+  # With the privileged helper all batches are a single request
+  batches = [(paths, value) for paths, value in batches if len(paths) > 0]
+  if len(batches) == 0:
+    return True
+  if sudo and helper is not None:
+    try:
+      return helper.write_batches([([str(path) for path in paths], value) for paths, value in batches])
+    except PrivilegedHelperError:
+      pass
+  success = True
+  for paths, value in batches:
+    success = write_attributes(paths, value, sudo) and success
+  return success
+
+
+def write_attributes(paths: List[Path], value: str, sudo: bool,
+                     helper: Optional[PrivilegedHelper] = None) -> bool:
+  # Writes the same value to all files, with sudo this is a single tee call
+  if len(paths) == 0:
+    return True
+  if sudo and helper is not None:
+    return write_attribute_batches([(paths, value)], sudo, helper)
+  if sudo:
+    tee_result = subprocess.run(["sudo", "tee"] + [str(path) for path in paths],
+                                input=value.encode(), capture_output=True)
+    return tee_result.returncode == 0
+  success = True
+  for path in paths:
+    try:
+      with open(path, 'w') as outF:
+        outF.write(value)
+    except OSError:
+      success = False
+  return success
@@ -0,0 +1,121 @@
+# powerSaver - Save power by controlling processes and services
+# Copyright (C) 2021  Nina Alexandra Klama
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import threading
+import time
+from typing import Dict, List, Optional
+
+from .processManager import ProcessManager
+
+
+class ThrottleGroup(object):
+  pids: List[int]
+  run: float
+  period: float
+  running: bool
+  next_switch: float
+
+  def __init__(self, pids: List[int], run: float, period: float, now: float):
+    self.pids = pids
+    self.run = run
+    self.period = period
+    self.running = False
+    self.next_switch = now + self.phase_length()
+
+  def phase_length(self) -> float:
+    if self.running:
+      return max(0.01, self.run)
+    return max(0.01, self.period - self.run)
+
+
+class ProcessThrottler(object):
+  process_manager: ProcessManager
+  groups: Dict[str, ThrottleGroup]
+  lock: threading.RLock            # Groups are added and removed from the action queue
+
+  def __init__(self, process_manager: ProcessManager):
+    self.process_manager = process_manager
+    self.groups = {}
+    self.lock = threading.RLock()
+
+  def is_throttled(self, title: str) -> bool:
+    return title in self.groups
+
+  def add(self, title: str, pids: List[int], run: float, period: float) -> bool:
+    with self.lock:
+      run = max(0.0, min(run, period))
+      if title in self.groups:
+        self.remove(title)
+      self.groups[title] = ThrottleGroup(pids, run, period, time.monotonic())
+      return self.process_manager.signal_pids(pids, True)
+
+  def update_pids(self, title: str, pids: List[int]) -> None:
+    with self.lock:
+      if title not in self.groups:
+        return
+      if len(pids) == 0:
+        del self.groups[title]
+        return
+      group = self.groups[title]
+      known = set(group.pids)
+      new_pids = [pid for pid in pids if pid not in known]
+      group.pids = pids
+      if not group.running:
+        self.process_manager.signal_pids(new_pids, True)
+
+  def remove(self, title: str) -> bool:
+    with self.lock:
+      if title not in self.groups:
+        return True
+      group = self.groups.pop(title)
+      return self.process_manager.signal_pids(list(reversed(group.pids)), False)
+
+  def release_all(self) -> None:
+    with self.lock:
+      for title in list(self.groups.keys()):
+        self.remove(title)
+
+  def next_deadline(self) -> Optional[float]:
+    with self.lock:
+      if len(self.groups) == 0:
+        return None
+      return min(group.next_switch for group in self.groups.values())
+
+  def sleep_length_ms(self) -> Optional[int]:
+    deadline = self.next_deadline()
+    if deadline is None:
+      return None
+    return max(0, int((deadline - time.monotonic()) * 1000.0 + 0.999))
+
+  def tick(self) -> None:
+    with self.lock:
+      now = time.monotonic()
+      to_stop = []
+      to_continue = []
+      for group in self.groups.values():
+        if group.next_switch > now:
+          continue
+        group.running = not group.running
+        if group.running:
+          to_continue += reversed(group.pids)
+        else:
+          to_stop += group.pids
+        # Schedule from the previous deadline rather than from now, so jitter does not accumulate
+        group.next_switch += group.phase_length()
+        if group.next_switch <= now:
+          group.next_switch = now + group.phase_length()
+      self.process_manager.signal_pids(to_continue, False)
+      self.process_manager.signal_pids(to_stop, True)
@@ -0,0 +1,46 @@
+from pathlib import Path
+
+from powerSaver.raplReader import RaplReader
+
+
+def make_zone(root: Path, zone: str, name: str, energy: int, max_energy: int = 1000000000) -> Path:
+  path = root / zone
+  path.mkdir()
+  (path / "name").write_text(name + "\n")
+  (path / "max_energy_range_uj").write_text(f"{max_energy}\n")
+  (path / "energy_uj").write_text(f"{energy}\n")
+  return path
+
+
+def set_energy(path: Path, energy: int) -> None:
+  (path / "energy_uj").write_text(f"{energy}\n")
+
+
+def update(reader: RaplReader, now: float) -> None:
+  for domain in reader.domains:
+    domain.update(now)
+
+
+def test_psys_is_not_counted_as_package(tmp_path: Path):
+  package = make_zone(tmp_path, "intel-rapl:0", "package-0", 0)
+  core    = make_zone(tmp_path, "intel-rapl:0:0", "core", 0)
+  psys    = make_zone(tmp_path, "intel-rapl:1", "psys", 0)
+  reader = RaplReader(str(tmp_path))
+  update(reader, 0.0)
+  set_energy(package, 5000000)
+  set_energy(core, 2000000)
+  set_energy(psys, 10000000)
+  update(reader, 1.0)
+
+  assert reader.get_watts() == {"package-0": 5.0, "package-0/core": 2.0, "psys": 10.0}
+  assert reader.package_watts() == 5.0
+
+
+def test_counter_wraparound(tmp_path: Path):
+  package = make_zone(tmp_path, "intel-rapl:0", "package-0", 9000000, max_energy=10000000)
+  reader = RaplReader(str(tmp_path))
+  update(reader, 0.0)
+  set_energy(package, 2000000)
+  update(reader, 1.0)
+
+  assert reader.package_watts() == 3.0